@@ -0,0 +1,62 @@
+"""
+Conversion of decoded (n, 128, 16) windows into typed agent attributes
+
+All conversions are vectorized over the whole batch, so that they keep up
+with the batches of latent_sampling.decode.
+"""
+import pickle
+from typing import NamedTuple
+
+import numpy as np
+
+from preprocessing import poll_values
+
+cutoff_value = 0.5
+"""Threshold of the recycling probabilities"""
+
+recycling_names = ["plastic", "glass", "magazines", "newspapers", "metals"]
+"""Recycled materials, in the order of the recycling columns 0:5"""
+
+flight_names = ["short-range", "mid-range", "long-range"]
+"""Flight ranges, in the order of the plane mobility columns 6:9"""
+
+vote_categories = poll_values[::-1]
+"""Co2 poll votes by vote code; the code of a vote is 3 minus its one-hot column"""
+
+
+class AgentAttributes(NamedTuple):
+    """Attributes of n agents over the 128 time steps of their windows"""
+    recycling: np.ndarray
+    """(n, 128, 5) bool, whether the agent recycles each material"""
+    car_km: np.ndarray
+    """(n, 128) float32, km driven per year"""
+    flights: np.ndarray
+    """(n, 128, 3) int32, number of flights per year and range"""
+    vote: np.ndarray
+    """(n, 128) int8, vote code into vote_categories"""
+    diet: np.ndarray
+    """(n, 128) float32, diet preference"""
+
+
+def load_mobility_max(path="dataset_mobility_max.p"):
+    """Loads the scaling factors of the mobility features saved by preparation.org"""
+    with open(path, "rb") as f:
+        return np.asarray(pickle.load(f), dtype=np.float64)
+
+
+def decode_attributes(samples, mobility_max, cutoff=cutoff_value):
+    """Converts decoded (n, 128, 16) windows into AgentAttributes
+
+    mobility_max holds the scaling factors of the car and the three plane
+    mobility features, see load_mobility_max.
+    """
+    samples = np.asarray(samples)
+    mobility_max = np.asarray(mobility_max, dtype=np.float64)
+
+    return AgentAttributes(
+        recycling=samples[..., 0:5] >= cutoff,
+        car_km=(samples[..., 5] * mobility_max[0]).astype(np.float32),
+        flights=np.rint(samples[..., 6:9] * mobility_max[1:4]).astype(np.int32),
+        vote=(len(poll_values) - 1 - np.argmax(samples[..., 9:13], axis=-1)).astype(np.int8),
+        diet=samples[..., 13].astype(np.float32),
+    )
@@ -0,0 +1,229 @@
+"""
+Local HTTP service generating synthetic agents on demand
+
+The decoder is loaded once. Concurrent requests are collected for up to
+max_delay seconds (or until max_batch_size agents are requested) and decoded
+together in a single decoder call, in a worker thread, so that the event loop
+keeps accepting requests meanwhile.
+
+Endpoints:
+    GET /agents?n=N     N agents: their attribute time series and GHG footprints, as JSON
+    GET /metrics        request latency percentiles (p50, p99) and throughput, as JSON
+
+Usage: python agent_server.py decoder [--host H] [--port P] [--max-batch-size N] [--max-delay-ms D]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from agent_attributes import decode_attributes, load_mobility_max
+from decoder_export import load_decoder
+from epa_ghg_calculator import calculate_co2_linear
+from latent_sampling import compile_decoder
+from population_synthesis import footprint_features
+
+reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class AgentServer:
+    """Serves agents decoded from prior draws, micro-batching concurrent requests"""
+
+    def __init__(self, decoder, mobility_max, max_batch_size=4096, max_delay=0.005, max_agents=1000,
+                 seed=None, latency_window=10000, latent_dim=2):
+        # decoder is a Keras decoder, or a compile_decoder function or NumpyDecoder of latent_dim inputs
+        if hasattr(decoder, "input_shape"):
+            latent_dim = decoder.input_shape[-1]
+            decoder = compile_decoder(decoder)
+        self.latent_dim = latent_dim
+        self.decoder = decoder
+        self.mobility_max = mobility_max
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_agents = max_agents
+        self.rng = np.random.default_rng(seed)
+
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.requests = 0
+        self.agents = 0
+        self.batches = 0
+        self.started = time.monotonic()
+        self._pending = None
+
+    def generate(self, n):
+        """Decodes n agents drawn from the prior; runs in a worker thread"""
+        z = self.rng.standard_normal((n, self.latent_dim), dtype=np.float32)
+        samples = self.decoder(z)
+        attributes = decode_attributes(samples, self.mobility_max)
+        footprints = calculate_co2_linear(footprint_features(samples, self.mobility_max))
+        return attributes, footprints
+
+    async def agents_for(self, n):
+        """Returns the attributes and footprints of n agents, decoded together with concurrent requests"""
+        future = asyncio.get_running_loop().create_future()
+        await self._pending.put((n, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._pending.get()]
+            size = batch[0][0]
+            deadline = loop.time() + self.max_delay
+
+            # Collects the requests arriving until the deadline, or until the batch is full
+            while size < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._pending.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                size += request[0]
+
+            try:
+                attributes, footprints = await loop.run_in_executor(None, self.generate, size)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+
+            start = 0
+            for n, future in batch:
+                end = start + n
+                # Skips requests whose client has gone
+                if not future.done():
+                    future.set_result((type(attributes)(*(values[start:end] for values in attributes)),
+                                       footprints[start:end]))
+                start = end
+
+    def metrics(self):
+        latencies = np.asarray(self.latencies) * 1000
+        uptime = time.monotonic() - self.started
+        return {
+            "requests": self.requests,
+            "agents": self.agents,
+            "batches": self.batches,
+            "mean_batch_agents": self.agents / self.batches if self.batches else 0.,
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            "requests_per_sec": self.requests / uptime,
+            "agents_per_sec": self.agents / uptime,
+        }
+
+    async def respond(self, method, target):
+        """Returns the status and the JSON body of a request"""
+        url = urlsplit(target)
+        if url.path not in ("/agents", "/metrics"):
+            return 404, {"error": "unknown path {}".format(url.path)}
+        if method != "GET":
+            return 405, {"error": "use GET"}
+        if url.path == "/metrics":
+            return 200, self.metrics()
+
+        try:
+            n = int(parse_qs(url.query).get("n", ["1"])[0])
+        except ValueError:
+            return 400, {"error": "n must be an integer"}
+        if not 1 <= n <= self.max_agents:
+            return 400, {"error": "n must be between 1 and {}".format(self.max_agents)}
+
+        start = time.perf_counter()
+        attributes, footprints = await self.agents_for(n)
+        body = {name: values.tolist() for name, values in attributes._asdict().items()}
+        body["footprint"] = footprints.tolist()
+
+        self.latencies.append(time.perf_counter() - start)
+        self.requests += 1
+        self.agents += n
+        return 200, body
+
+    async def handle(self, reader, writer):
+        """Serves the HTTP/1.1 requests of a connection, keeping it open between requests"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    content_length = int(headers.get("content-length", 0))
+                except ValueError:
+                    content_length = -1
+                if content_length < 0:
+                    # The end of the body is unknown, so the connection can't be reused
+                    status, body = 400, {"error": "invalid Content-Length"}
+                    headers["connection"] = "close"
+                else:
+                    await reader.readexactly(content_length)
+                    try:
+                        method, target, _ = request_line.decode("latin-1").split()
+                    except ValueError:
+                        status, body = 400, {"error": "malformed request line"}
+                    else:
+                        status, body = await self.respond(method, target)
+
+                payload = json.dumps(body).encode()
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n"
+                             .format(status, reasons[status], len(payload)).encode() + payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8080):
+        """Starts serving and returns the asyncio server; port 0 picks a free port"""
+        self._pending = asyncio.Queue()
+        self.started = time.monotonic()
+        self._batcher_task = asyncio.create_task(self._batcher())
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(server, host, port):
+    tcp_server = await server.start(host, port)
+    print("Serving agents on http://{}:{}".format(host, tcp_server.sockets[0].getsockname()[1]))
+    async with tcp_server:
+        await tcp_server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("decoder", help="saved Keras decoder, e.g. decoder_hyper_2.pb, or .npz export of decoder_export.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=4096)
+    parser.add_argument("--max-delay-ms", type=float, default=5.)
+    parser.add_argument("--mobility-max", default="dataset_mobility_max.p")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    decoder = load_decoder(args.decoder)
+    server = AgentServer(decoder,
+                         load_mobility_max(args.mobility_max),
+                         max_batch_size=args.max_batch_size,
+                         max_delay=args.max_delay_ms / 1000,
+                         seed=args.seed,
+                         latent_dim=getattr(decoder, "latent_dim", 2))
+    asyncio.run(serve(server, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
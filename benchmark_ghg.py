@@ -0,0 +1,57 @@
+"""Compares the scalar, the vectorized and the compiled linear GHG footprint calculation.
+
+Usage: python benchmark_ghg.py [number of samples]
+"""
+import sys
+import timeit
+
+import numpy as np
+
+from epa_ghg_calculator import calculate_co2, calculate_co2_batch, calculate_co2_linear
+
+
+def random_samples(n, seed=42):
+    """Generates n random feature vectors in the (N, 16) layout of the dataset"""
+    rng = np.random.default_rng(seed)
+    sample = np.zeros((n, 16))
+
+    # Recycling (0:5)
+    sample[:, 0:5] = rng.integers(0, 2, size=(n, 5))
+
+    # Mobility (5:9), in km and number of flights
+    sample[:, 5] = rng.uniform(0, 30000, size=n)
+    sample[:, 6:9] = rng.integers(0, 10, size=(n, 3))
+
+    # Co2 poll (9:13)
+    sample[np.arange(n), 9 + rng.integers(0, 4, size=n)] = 1.0
+
+    # Diet (13:14)
+    sample[:, 13] = rng.uniform(0, 1, size=n)
+
+    return sample
+
+
+def main(n):
+    sample = random_samples(n)
+
+    footprints_scalar = np.array(calculate_co2(sample))
+    footprints_batch = calculate_co2_batch(sample)
+    assert np.array_equal(footprints_scalar, footprints_batch), "scalar and batch footprints differ"
+    footprints_linear = calculate_co2_linear(sample)
+    assert np.allclose(footprints_scalar, footprints_linear, rtol=1e-12, atol=0), "linear model footprints differ"
+
+    repeat = 3
+    time_scalar = min(timeit.repeat(lambda: calculate_co2(sample), number=1, repeat=repeat))
+    time_batch = min(timeit.repeat(lambda: calculate_co2_batch(sample), number=1, repeat=repeat))
+    time_linear = min(timeit.repeat(lambda: calculate_co2_linear(sample), number=1, repeat=repeat))
+
+    print("samples:        {}".format(n))
+    print("calculate_co2:       {:10.4f} s  ({:12.0f} samples/s)".format(time_scalar, n / time_scalar))
+    print("calculate_co2_batch: {:10.4f} s  ({:12.0f} samples/s)".format(time_batch, n / time_batch))
+    print("calculate_co2_linear:{:10.4f} s  ({:12.0f} samples/s)".format(time_linear, n / time_linear))
+    print("speedup batch:  {:.1f}x".format(time_scalar / time_batch))
+    print("speedup linear: {:.1f}x".format(time_scalar / time_linear))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,90 @@
+"""Measures the training steps/sec of the VAE for several TrainingConfig settings.
+
+Each setting runs in its own process, as TensorFlow reads the oneDNN and thread
+settings when it starts. The model is built by model_builder of vae5_hyper.py
+with the default hyperparameters, and trained on random windows.
+
+Usage: python benchmark_training.py [number of steps]
+"""
+import dataclasses
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from training_config import TrainingConfig, bfloat16_supported
+
+
+def settings():
+    """Named settings to compare, starting with the TensorFlow defaults"""
+    cores = os.cpu_count()
+    result = {
+        "default": TrainingConfig(),
+        "no onednn": TrainingConfig(onednn=False),
+        "threads": TrainingConfig(intra_op_threads=cores, inter_op_threads=1),
+        "xla": TrainingConfig(jit_compile=True),
+    }
+    if bfloat16_supported():
+        result["bfloat16"] = TrainingConfig(precision="mixed_bfloat16")
+        result["bfloat16 xla"] = TrainingConfig(precision="mixed_bfloat16", jit_compile=True)
+    return result
+
+
+def random_windows(n, seed=42):
+    """Generates n random (128, 16) windows in the normalized layout of the dataset"""
+    rng = np.random.default_rng(seed)
+    windows = rng.uniform(0, 1, size=(n, 128, 16)).astype(np.float32)
+    windows[:, :, 0:5] = rng.integers(0, 2, size=(n, 128, 5))
+    windows[:, :, 9:13] = np.eye(4, dtype=np.float32)[rng.integers(0, 4, size=(n, 128))]
+    windows[:, :, 14:16] = 0
+    return windows
+
+
+def run(config, steps, batch_size=64, warmup=10):
+    """Trains for steps batches in this process and returns the steps/sec"""
+    config.apply()
+
+    import keras_tuner as kt
+    from tensorflow import keras
+    import vae5_hyper
+    from input_pipeline import windows_dataset
+
+    vae5_hyper.training_config = config
+    model = vae5_hyper.model_builder(kt.HyperParameters())
+    data = windows_dataset(random_windows(batch_size * 16), batch_size=batch_size).repeat()
+
+    # The first steps trace and compile the training step and are not timed
+    times = []
+    timer = keras.callbacks.LambdaCallback(on_train_batch_end=lambda batch, logs=None: times.append(time.perf_counter()))
+    model.fit(data, epochs=1, steps_per_epoch=warmup + steps, callbacks=[timer], verbose=0)
+    return steps / (times[-1] - times[warmup - 1])
+
+
+def main(steps, max_slowdown=2.):
+    """Runs all settings; fails if a setting is more than max_slowdown times slower than the default"""
+    batch_size = 64
+    print("steps:          {}".format(steps))
+    results = {}
+    for name, config in settings().items():
+        command = [sys.executable, __file__, "--run", json.dumps(dataclasses.asdict(config)), str(steps)]
+        env = dict(os.environ, **config.environ())
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        steps_per_sec = results[name] = float(output.splitlines()[-1])
+        slower = "  slower than default" if steps_per_sec < results["default"] else ""
+        print("{:14s} {:10.1f} steps/s  ({:10.0f} samples/s){}".format(
+            name, steps_per_sec, steps_per_sec * batch_size, slower))
+
+    regressions = [name for name, steps_per_sec in results.items()
+                   if steps_per_sec * max_slowdown < results["default"]]
+    if regressions:
+        sys.exit("main: {} more than {}x slower than default".format(", ".join(regressions), max_slowdown))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        print(run(TrainingConfig(**json.loads(sys.argv[2])), int(sys.argv[3])))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
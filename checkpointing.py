@@ -0,0 +1,116 @@
+"""
+Periodic checkpoints of long training runs, and resuming from the latest one
+"""
+import logging
+import os
+import threading
+import uuid
+
+import tensorflow as tf
+from tensorflow import keras
+
+
+def write_checkpoint_state(directory, names):
+    """Writes the "checkpoint" file of directory, listing the checkpoint names, the latest one last
+
+    Read by tf.train.latest_checkpoint and tf.train.CheckpointManager.
+    """
+    lines = ['model_checkpoint_path: "{}"'.format(names[-1])]
+    lines += ['all_model_checkpoint_paths: "{}"'.format(name) for name in names]
+    path = os.path.join(directory, "checkpoint")
+    with open(path + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+class Checkpointer(keras.callbacks.Callback):
+    """Saves the model, the optimizer state and the loss trackers every period epochs
+
+    The model must be compiled. Only the max_to_keep latest checkpoints in
+    directory are kept. Checkpoints are written in the background: the
+    variables are saved to memory (TensorFlow's ram:// file system) on the
+    training thread, and the files are written to directory by a writer
+    thread while training goes on. The asynchronous checkpoints of
+    tf.train.CheckpointOptions are not used, as they do not support the
+    variables of Keras 3 models.
+
+    Resumes a run with:
+
+        checkpointer = Checkpointer(vae, "checkpoints")
+        vae.fit(..., initial_epoch = checkpointer.restore(), callbacks = [checkpointer])
+    """
+    def __init__(self, model, directory, max_to_keep=3, period=1):
+        super(Checkpointer, self).__init__()
+        self.directory = directory
+        self.max_to_keep = max_to_keep
+        self.period = period
+        self.epoch = tf.Variable(0, trainable=False, dtype=tf.int64)
+        self.optimizer = model.optimizer
+        self.variables = model.trainable_variables
+        self.checkpoint = tf.train.Checkpoint(model=model,
+                                              optimizer=model.optimizer,
+                                              metrics=list(model.metrics),
+                                              epoch=self.epoch)
+        self.memory_directory = "ram://checkpoints/{}".format(uuid.uuid4().hex)
+        self.writer = None
+        self.error = None
+
+        state = tf.train.get_checkpoint_state(directory)
+        self.names = [os.path.basename(path) for path in state.all_model_checkpoint_paths] if state else []
+
+    @property
+    def latest_checkpoint(self):
+        return tf.train.latest_checkpoint(self.directory)
+
+    def restore(self):
+        """Restores the latest checkpoint, if any, and returns the number of epochs it was trained for"""
+        latest_checkpoint = self.latest_checkpoint
+        if latest_checkpoint is None:
+            return 0
+
+        # Creates the optimizer state, so that it is restored now rather than on the first step
+        if not getattr(self.optimizer, "built", True):
+            self.optimizer.build(self.variables)
+
+        self.checkpoint.restore(latest_checkpoint).expect_partial()
+        logging.info("Checkpointer: restored %s", latest_checkpoint)
+        return int(self.epoch.numpy())
+
+    def _write(self, name):
+        """Moves the files of a checkpoint from memory to directory, and drops the oldest checkpoints"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for source in tf.io.gfile.glob("{}/{}.*".format(self.memory_directory, name)):
+                tf.io.gfile.copy(source, os.path.join(self.directory, os.path.basename(source)), overwrite=True)
+                tf.io.gfile.remove(source)
+
+            self.names = [n for n in self.names if n != name] + [name]
+            removed, self.names = self.names[:-self.max_to_keep], self.names[-self.max_to_keep:]
+            write_checkpoint_state(self.directory, self.names)
+            for old in removed:
+                for path in tf.io.gfile.glob(os.path.join(self.directory, old + ".*")):
+                    tf.io.gfile.remove(path)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """Waits for the checkpoint being written, and raises its error, if any"""
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch.assign(epoch + 1)
+        if (epoch + 1) % self.period == 0:
+            # At most one checkpoint is in memory at any time
+            self.wait()
+            name = "ckpt-{}".format(epoch + 1)
+            self.checkpoint.write("{}/{}".format(self.memory_directory, name))
+            self.writer = threading.Thread(target=self._write, args=(name,), name="Checkpointer")
+            self.writer.start()
+
+    def on_train_end(self, logs=None):
+        self.wait()
@@ -0,0 +1,140 @@
+"""
+Export of the decoder to a .npz file, and its forward pass in NumPy
+
+The decoders of model_builder are a Dense layer, a Reshape and one or two
+Conv1DTranspose layers with stride 1 and "same" padding. NumpyDecoder runs
+them without TensorFlow, so that sampling workers start in milliseconds and
+many of them fit on one host; it works wherever latent_sampling.decode and
+population_synthesis.synthesize take a decoder.
+
+Usage: python decoder_export.py decoder output.npz
+"""
+import argparse
+import json
+
+import numpy as np
+
+def sigmoid(x):
+    # In place, as the outputs are the largest arrays of the forward pass
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1
+    return np.reciprocal(x, out=x)
+
+
+activations = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "sigmoid": sigmoid,
+}
+
+
+def export_decoder(decoder, path):
+    """Saves the layers and weights of a Keras decoder to a .npz file"""
+    architecture = []
+    weights = {}
+    for layer in decoder.layers:
+        kind = type(layer).__name__
+        if kind == "InputLayer":
+            continue
+
+        config = layer.get_config()
+        spec = {"kind": kind, "activation": config.get("activation", "linear")}
+        if kind == "Reshape":
+            spec["target_shape"] = list(config["target_shape"])
+        elif kind in ("Dense", "Conv1DTranspose"):
+            if kind == "Conv1DTranspose" and (tuple(config["strides"]) != (1,) or config["padding"] != "same"):
+                raise ValueError("export_decoder: only stride 1 and same padding are supported, got {}".format(
+                    layer.name))
+            kernel, bias = layer.get_weights()
+            weights["{}_kernel".format(len(architecture))] = kernel.astype(np.float32)
+            weights["{}_bias".format(len(architecture))] = bias.astype(np.float32)
+        else:
+            raise ValueError("export_decoder: unsupported layer {} ({})".format(layer.name, kind))
+
+        if spec["activation"] not in activations:
+            raise ValueError("export_decoder: unsupported activation {}".format(spec["activation"]))
+        architecture.append(spec)
+
+    np.savez(path, architecture=np.array(json.dumps(architecture)), **weights)
+
+
+def conv1d_transpose_same(inputs, kernel):
+    """Conv1DTranspose with stride 1 and same padding of (n, length, in) inputs
+
+    kernel has the Keras shape (kernel_size, out, in):
+    out[t] = sum_k inputs[t - k + (kernel_size - 1) // 2] @ kernel[k].T
+    """
+    kernel_size, channels = kernel.shape[:2]
+    n, length = inputs.shape[:2]
+    before = (kernel_size - 1) // 2
+    padded = np.pad(inputs, ((0, 0), (kernel_size - 1 - before, before), (0, 0)))
+
+    # Multiplies with all kernel positions in a single 2D matrix product,
+    # then adds up the products shifted by their kernel position
+    products = padded.reshape(-1, padded.shape[-1]) @ kernel.transpose(2, 0, 1).reshape(kernel.shape[2], -1)
+    products = products.reshape(n, length + kernel_size - 1, kernel_size, channels)
+
+    outputs = products[:, kernel_size - 1:kernel_size - 1 + length, 0].copy()
+    for k in range(1, kernel_size):
+        shift = kernel_size - 1 - k
+        outputs += products[:, shift:shift + length, k]
+    return outputs
+
+
+class NumpyDecoder:
+    """Forward pass of a decoder exported by export_decoder
+
+    The latent points are decoded in chunks of chunk_size, whose intermediate
+    arrays stay in the CPU caches.
+    """
+
+    def __init__(self, path, chunk_size=256):
+        self.chunk_size = chunk_size
+        with np.load(path) as data:
+            self.architecture = json.loads(str(data["architecture"]))
+            self.weights = {name: data[name] for name in data.files if name != "architecture"}
+        self.latent_dim = self.weights["0_kernel"].shape[0]
+
+    def __call__(self, z):
+        z = np.asarray(z, dtype=np.float32)
+        return np.concatenate([self.forward(z[start:start + self.chunk_size])
+                               for start in range(0, max(len(z), 1), self.chunk_size)])
+
+    def forward(self, x):
+        for i, spec in enumerate(self.architecture):
+            if spec["kind"] == "Reshape":
+                x = x.reshape((len(x),) + tuple(spec["target_shape"]))
+                continue
+
+            kernel = self.weights["{}_kernel".format(i)]
+            if spec["kind"] == "Dense":
+                x = x @ kernel
+            else:
+                x = conv1d_transpose_same(x, kernel)
+            x += self.weights["{}_bias".format(i)]
+            x = activations[spec["activation"]](x)
+        return x
+
+
+def load_decoder(path):
+    """Loads a NumpyDecoder from a .npz file, otherwise a Keras decoder"""
+    if path.endswith(".npz"):
+        return NumpyDecoder(path)
+
+    from tensorflow import keras
+    return keras.models.load_model(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("decoder", help="saved Keras decoder, e.g. decoder_hyper_2.pb")
+    parser.add_argument("output", help=".npz file")
+    args = parser.parse_args()
+
+    from tensorflow import keras
+    export_decoder(keras.models.load_model(args.decoder), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,70 @@
+import functools
 import logging
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+import numpy as np
+
+
+def cell(method):
+    """memoizes a cell formula for the current request
+
+    The value is kept in self._cell_values, which is cleared whenever new inputs
+    are set, so that each cell is evaluated at most once per request.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def memoized(self):
+        try:
+            return self._cell_values[name]
+        except KeyError:
+            res = self._cell_values[name] = method(self)
+            return res
+
+    return memoized
+
+
+class EmissionBreakdown(NamedTuple):
+    """emissions per category in pounds of carbon dioxide equivalent/year
+
+    Fields are floats for calculate_breakdown() and arrays for calculate_breakdown_batch().
+    """
+    driving: float
+    natural_gas: float
+    electricity: float
+    fuel_oil: float
+    propane: float
+    waste: float
+    flights: float
+    food: float
+    total: float
+
+
+def _freeze(mapping):
+    """read-only copy of a (nested) dict"""
+    return MappingProxyType({
+        key: _freeze(value) if isinstance(value, Mapping) else value
+        for (key, value) in mapping.items()
+    })
+
+
+@dataclass(frozen=True)
+class EPAGHGCalculatorConfig:
+    """immutable settings of an EPAGHGCalculator, safe to share between threads
+
+    flights_average_km_and_costs replaces the flight table of the calculator,
+    emission_factors overrides class-level factors by name (e.g. e_factor_value),
+    one of emission_factor_names.
+    """
+    flights_average_km_and_costs: Mapping = None
+    emission_factors: Mapping = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.flights_average_km_and_costs is not None:
+            object.__setattr__(self, "flights_average_km_and_costs", _freeze(self.flights_average_km_and_costs))
+        object.__setattr__(self, "emission_factors", _freeze(self.emission_factors))
 
 
 class EPAGHGCalculator:
@@ -11,13 +77,22 @@ class EPAGHGCalculator:
     * does NOT contain emissions from flying or indirect emissions from consumption!
     
     USAGE:
-    * initialize once upfront
+    * initialize once upfront, optionally with an EPAGHGCalculatorConfig
     * for each request, call calculate() once
+    
+    calculate() and its variants never modify the calculator: the inputs are set
+    on a per-request copy (see bind()), so one instance can serve several threads.
     """
 
-    def __init__(self):
-        # nothing to do so far
-        pass
+    def __init__(self, config=None):
+        self.config = config if config is not None else EPAGHGCalculatorConfig()
+        if self.config.flights_average_km_and_costs is not None:
+            self.flights_average_km_and_costs = self.config.flights_average_km_and_costs
+        for (name, value) in self.config.emission_factors.items():
+            if name not in emission_factor_names:
+                raise ValueError("EPAGHGCalculator: unknown emission factor '%s'" % name)
+            setattr(self, name, value)
+        self._cell_values = {}
 
     poundsToKg = 1 / 2.2046
     kgToPounds = 2.2046
@@ -200,6 +275,7 @@ class EPAGHGCalculator:
     def K15(self):
         return self.average_mpg
 
+    @cell
     def J26(self):
         """= IF(vehicle1MilesD15=0,
              0,
@@ -214,9 +290,11 @@ class EPAGHGCalculator:
                 self.EF_passenger_vehicle * self.nonCO2_vehicle_emissions_ratio / self.K15()
                 + self.J29()
         )
-        logging.debug("EPAGHGCalculator: J26 = %f" % res)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("EPAGHGCalculator: J26 = %f", res)
         return res
 
+    @cell
     def J29(self):
         """pounds/yr
 
@@ -236,9 +314,11 @@ class EPAGHGCalculator:
             if self.vehicleMaintenanceF29 == 2
             else 0
         )
-        logging.debug("EPAGHGCalculator: J29 = %f" % res)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("EPAGHGCalculator: J29 = %f", res)
         return res
 
+    @cell
     def J37(self):
         """Pounds of carbon dioxide/year.
 
@@ -260,9 +340,11 @@ class EPAGHGCalculator:
                 else self.EF_natural_gas_therm * self.naturalGasF37 * 12
             )
         )
-        logging.debug("EPAGHGCalculator: J37 = %f" % res)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("EPAGHGCalculator: J37 = %f", res)
         return res
 
+    @cell
     def J42(self):
         """Pounds of carbon dioxide equivalent/year
 
@@ -292,9 +374,11 @@ class EPAGHGCalculator:
                 else self.electricityF42 * self.e_factor_value * 12 * (1 - self.greenPowerPercentF49 / 100)
             )
         )
-        logging.debug("EPAGHGCalculator: J42 = %f" % res)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("EPAGHGCalculator: J42 = %f", res)
         return res
 
+    @cell
     def J53(self):
         """Pounds of carbon dioxide/year
 
@@ -310,9 +394,11 @@ class EPAGHGCalculator:
             if self.fuelOilUnitH53 == 1
             else self.EF_fuel_oil_gallon * self.fuelOilF53 * 12
         )
-        logging.debug("EPAGHGCalculator: J53 = %f" % res)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("EPAGHGCalculator: J53 = %f", res)
         return res
 
+    @cell
     def J57(self):
         """Propane emissions
         
@@ -329,9 +415,11 @@ class EPAGHGCalculator:
             if self.propaneUnitH57 == 1
             else self.EF_propane * self.propaneF57 * 12
         )
-        logging.debug("EPAGHGCalculator: J57 = %f" % res)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("EPAGHGCalculator: J57 = %f", res)
         return res
 
+    @cell
     def J63(self):
         """Pounds of carbon dioxide equivalent/year
 
@@ -341,6 +429,7 @@ class EPAGHGCalculator:
         """
         return self.peopleInHouseholdF5 * self.average_waste_emissions
 
+    @cell
     def J65(self):
         """Pounds of carbon dioxide equivalent/year
 
@@ -352,6 +441,7 @@ class EPAGHGCalculator:
             else 0
         )
 
+    @cell
     def J67(self):
         """Pounds of carbon dioxide equivalent/year
         
@@ -359,6 +449,7 @@ class EPAGHGCalculator:
         """
         return self.peopleInHouseholdF5 * self.plastic_recycling_avoided_emissions if self.recyclePlasticF67 == 1 else 0
 
+    @cell
     def J69(self):
         """Pounds of carbon dioxide equivalent/year
         
@@ -366,6 +457,7 @@ class EPAGHGCalculator:
         """
         return self.peopleInHouseholdF5 * self.glass_recycling_avoided_emissions if self.recycleGlassF69 == 1 else 0
 
+    @cell
     def J71(self):
         """Pounds of carbon dioxide equivalent/year
         
@@ -374,6 +466,7 @@ class EPAGHGCalculator:
         return self.peopleInHouseholdF5 \
             * self.newspaper_recycling_avoided_emissions if self.recycleNewspaperF71 == 1 else 0
 
+    @cell
     def J73(self):
         """Pounds of carbon dioxide equivalent/year
         
@@ -381,6 +474,7 @@ class EPAGHGCalculator:
         """
         return self.peopleInHouseholdF5 * self.mag_recycling_avoided_emissions if self.recycleMagsF73 == 1 else 0
 
+    @cell
     def J77(self):
         """Total Waste Emissions After Recycling
         
@@ -389,9 +483,11 @@ class EPAGHGCalculator:
         =J63+(SUM(J65,J67,J69,J71,J73))
         """
         res = self.J63() + self.J65() + self.J67() + self.J69() + self.J71() + self.J73()
-        logging.debug("EPAGHGCalculator: J77 = %f" % res)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("EPAGHGCalculator: J77 = %f", res)
         return res
 
+    @cell
     def co2_emissions_through_food_consumption(self):
         """Pounds of carbon dioxide equivalent/year
          food preferences contribute
@@ -399,6 +495,7 @@ class EPAGHGCalculator:
         """
         return self.kgToPounds * (740 + self.foodPreferences_vegan2MeatScale * (1820 - 740))
 
+    @cell
     def co2_emissions_caused_by_flights(self):
         """We assume a fixed (and identical) CO2 emission of 88 gr / flight kilometers.
         We only distinguish between short flights (at most 1000km, average 750),
@@ -415,6 +512,7 @@ class EPAGHGCalculator:
         return self.flights_average_km_and_costs[flight_type]['kilometersPerTrip'] * \
                self.flights_average_km_and_costs[flight_type]['co2PerKilometerInKG']
 
+    @cell
     def J82(self):
         """Your Total Emissions
 
@@ -424,44 +522,263 @@ class EPAGHGCalculator:
         """
         res = self.J26() + self.J37() + self.J42() + self.J53() + self.J57() + self.J77()
         res = res + self.co2_emissions_through_food_consumption() + self.co2_emissions_caused_by_flights()
-        logging.debug("EPAGHGCalculator: J82 = %f" % res)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("EPAGHGCalculator: J82 = %f", res)
         return res
 
         # TODO: add reduction potential from rows 87 on!
 
-    def calculate(self, input_dict):
+    # Vectorized cell formulae, evaluated on columns of inputs (see calculate_batch).
+    # Each one mirrors the scalar cell above operation by operation, so that
+    # results agree bit for bit with calculate() for float64 inputs.
+
+    @cell
+    def J26_batch(self):
+        return (
+                self.vehicle1MilesD15 * np.where(self.vehicle1MilesUnitG15 == 1, 52, 1) *
+                self.EF_passenger_vehicle * self.nonCO2_vehicle_emissions_ratio / self.K15()
+                + self.J29_batch()
+        )
+
+    @cell
+    def J29_batch(self):
+        return np.where(
+            self.vehicleMaintenanceF29 == 2,
+            self.vehicle1MilesD15 * np.where(
+                self.vehicle1MilesUnitG15 == 1, 52, 1
+            ) * self.EF_passenger_vehicle * self.nonCO2_vehicle_emissions_ratio *
+            self.vehicle_efficiency_improvements / self.K15(),
+            0
+        )
+
+    @cell
+    def J37_batch(self):
+        return np.where(
+            self.naturalGasUnitH37 == 1,
+            self.naturalGasF37 / self.natural_gas_cost_1000CF * self.EF_natural_gas * 12,
+            np.where(
+                self.naturalGasUnitH37 == 2,
+                self.EF_natural_gas * self.naturalGasF37 * 12,
+                self.EF_natural_gas_therm * self.naturalGasF37 * 12
+            )
+        )
+
+    @cell
+    def J42_batch(self):
+        return np.where(
+            self.greenPowerF45 == 2,
+            np.where(
+                self.electricityUnitH42 == 1,
+                self.electricityF42 / self.cost_per_kWh * self.e_factor_value * 12,
+                self.electricityF42 * self.e_factor_value * 12
+            ),
+            np.where(
+                self.electricityUnitH42 == 1,
+                self.electricityF42 / self.cost_per_kWh * self.e_factor_value * 12 * (
+                            1 - self.greenPowerPercentF49 / 100),
+                self.electricityF42 * self.e_factor_value * 12 * (1 - self.greenPowerPercentF49 / 100)
+            )
+        )
+
+    @cell
+    def J53_batch(self):
+        return np.where(
+            self.fuelOilUnitH53 == 1,
+            self.fuelOilF53 / self.fuel_oil_cost * self.EF_fuel_oil_gallon * 12,
+            self.EF_fuel_oil_gallon * self.fuelOilF53 * 12
+        )
+
+    @cell
+    def J57_batch(self):
+        return np.where(
+            self.propaneUnitH57 == 1,
+            self.propaneF57 / self.propane_cost * self.EF_propane * 12,
+            self.EF_propane * self.propaneF57 * 12
+        )
+
+    @cell
+    def J77_batch(self):
+        return (
+            self.J63()
+            + np.where(self.recycleAluminumF65 == 1, self.peopleInHouseholdF5 * self.metal_recycling_avoided_emissions, 0)
+            + np.where(self.recyclePlasticF67 == 1, self.peopleInHouseholdF5 * self.plastic_recycling_avoided_emissions, 0)
+            + np.where(self.recycleGlassF69 == 1, self.peopleInHouseholdF5 * self.glass_recycling_avoided_emissions, 0)
+            + np.where(self.recycleNewspaperF71 == 1,
+                       self.peopleInHouseholdF5 * self.newspaper_recycling_avoided_emissions, 0)
+            + np.where(self.recycleMagsF73 == 1, self.peopleInHouseholdF5 * self.mag_recycling_avoided_emissions, 0)
+        )
+
+    @cell
+    def J82_batch(self):
+        res = self.J26_batch() + self.J37_batch() + self.J42_batch() + self.J53_batch() + self.J57_batch() \
+            + self.J77_batch()
+        # food and flights are plain arithmetic, so the scalar formulae work on columns as well
+        return res + self.co2_emissions_through_food_consumption() + self.co2_emissions_caused_by_flights()
+
+    def bind(self, input_dict):
+        """per-request copy of this calculator with inputs from input_dict, see set_inputs()
+
+        The copy shares the configuration of self, which stays untouched.
+        """
+        sheet = object.__new__(type(self))
+        sheet.__dict__.update(self.__dict__)
+        sheet.set_inputs(input_dict)
+        return sheet
+
+    def set_inputs(self, input_dict):
+        """sets all inputs to their defaults, then to the submitted values of input_dict
+
+        Modifies self; use bind() on calculators shared between requests.
+        """
+        self._cell_values = {}
+        debug = logging.root.isEnabledFor(logging.DEBUG)
         for (key, pair) in self.input_labels_defaults.items():
             label, default = pair
-            logging.debug("EPAGHGCalculator: default value for key " + key + " (" + label + ") is " + str(default))
+            if debug:
+                logging.debug("EPAGHGCalculator: default value for key %s (%s) is %s", key, label, default)
             setattr(self, key, default)
         for (key, value) in input_dict.items():
             if key in self.input_labels_defaults.keys():
                 # label, default = self.input_labels_defaults[key]
                 if value is not None:
-                    logging.debug("EPAGHGCalculator: actual value for key %s submitted as %s" % (key, str(value)))
+                    if debug:
+                        logging.debug("EPAGHGCalculator: actual value for key %s submitted as %s", key, value)
                     setattr(self, key, value)
                 else:
                     logging.warning("EPAGHGCalculator: 'None' value submitted for key %s, sticking to default" % key)
             else:
                 logging.warning("EPAGHGCalculator:  key '%s' unknown, with value: %s" % (str(key), str(value)))
 
+    def breakdown(self):
+        """EmissionBreakdown for the current inputs"""
+        return EmissionBreakdown(
+            driving=self.J26(),
+            natural_gas=self.J37(),
+            electricity=self.J42(),
+            fuel_oil=self.J53(),
+            propane=self.J57(),
+            waste=self.J77(),
+            flights=self.co2_emissions_caused_by_flights(),
+            food=self.co2_emissions_through_food_consumption(),
+            total=self.J82(),
+        )
+
+    def calculate_breakdown(self, input_dict):
+        """like calculate(), but returns the EmissionBreakdown instead of the total in GtC/yr"""
+        return self.bind(input_dict).breakdown()
+
+    def calculate(self, input_dict):
+        sheet = self.bind(input_dict)
+
+        # the percentage breakdown is only formatted if someone is going to read it
+        if not logging.root.isEnabledFor(logging.INFO):
+            return sheet.J82() * self.poundsCO2eq_to_GtC
+
         logging.info("EPAGHGCalculator: calculating")
-        total_carbon_emissions = self.J82()
+        breakdown = sheet.breakdown()
+        total_carbon_emissions = breakdown.total
         result = (f"""
-            due to driving {(100 * self.J26() / total_carbon_emissions):2.2f}%,
-            due to natural gas {(100 * self.J37() / total_carbon_emissions):2.2f}%, 
-            due to electricity {(100 * self.J42() / total_carbon_emissions):2.2f}%, 
-            due to fuel oil {(100 * self.J53() / total_carbon_emissions):2.2f}%, 
-            due to propane {(100 * self.J57() / total_carbon_emissions):2.2f}%, 
-            due to waste after recycling {(100 * self.J77() / total_carbon_emissions):2.2f}%, 
-            due to flights {(100 * self.co2_emissions_caused_by_flights() / total_carbon_emissions):2.2f}%, 
-            due to food {(100 * self.co2_emissions_through_food_consumption() / total_carbon_emissions):2.2f}%, 
+            due to driving {(100 * breakdown.driving / total_carbon_emissions):2.2f}%,
+            due to natural gas {(100 * breakdown.natural_gas / total_carbon_emissions):2.2f}%, 
+            due to electricity {(100 * breakdown.electricity / total_carbon_emissions):2.2f}%, 
+            due to fuel oil {(100 * breakdown.fuel_oil / total_carbon_emissions):2.2f}%, 
+            due to propane {(100 * breakdown.propane / total_carbon_emissions):2.2f}%, 
+            due to waste after recycling {(100 * breakdown.waste / total_carbon_emissions):2.2f}%, 
+            due to flights {(100 * breakdown.flights / total_carbon_emissions):2.2f}%, 
+            due to food {(100 * breakdown.food / total_carbon_emissions):2.2f}%, 
             total carbon emissions {(total_carbon_emissions * self.poundsCO2eq_to_GtC)}[GtC/yr]
             """
         )
         logging.info("EPAGHGCalculator computed carbon emissions:  " + str(result))
         return total_carbon_emissions * self.poundsCO2eq_to_GtC
 
+    def co2_model_key(self):
+        """everything besides the inputs that a CompiledCO2Model depends on: defaults, flight table and factors"""
+        input_defaults = tuple((key, default) for (key, (label, default)) in self.input_labels_defaults.items())
+        flights = tuple(
+            (flight_type, costs['kilometersPerTrip'], costs['co2PerKilometerInKG'])
+            for (flight_type, costs) in sorted(self.flights_average_km_and_costs.items())
+        )
+        factors = tuple(
+            (name, getattr(self, name))
+            for name in dir(self)
+            if not name.startswith('_')
+            and name not in self.input_labels_defaults
+            and isinstance(getattr(self, name), (int, float))
+        )
+        return input_defaults, flights, factors
+
+    def bind_columns(self, input_columns):
+        """per-request copy of this calculator with input columns, see set_input_columns()"""
+        sheet = object.__new__(type(self))
+        sheet.__dict__.update(self.__dict__)
+        sheet.set_input_columns(input_columns)
+        return sheet
+
+    def set_input_columns(self, input_columns):
+        """sets all inputs to float64 columns, see calculate_batch()
+
+        Modifies self and returns the number of rows; use bind_columns() on calculators shared between requests.
+        """
+        columns = {}
+        for (key, values) in input_columns.items():
+            if key in self.input_labels_defaults.keys():
+                columns[key] = np.asarray(values, dtype=np.float64)
+            else:
+                logging.warning("EPAGHGCalculator:  key '%s' unknown, ignoring column" % str(key))
+        if not columns:
+            raise ValueError("EPAGHGCalculator: calculate_batch needs at least one input column")
+        n = len(next(iter(columns.values())))
+        for (key, values) in columns.items():
+            if values.shape != (n,):
+                raise ValueError("EPAGHGCalculator: column %s has shape %s, expected (%d,)"
+                                 % (key, str(values.shape), n))
+
+        self._cell_values = {}
+        for (key, pair) in self.input_labels_defaults.items():
+            label, default = pair
+            setattr(self, key, columns.get(key, np.full(n, default, dtype=np.float64)))
+        return n
+
+    def breakdown_batch(self):
+        """EmissionBreakdown of arrays for the current input columns"""
+        return EmissionBreakdown(
+            driving=self.J26_batch(),
+            natural_gas=self.J37_batch(),
+            electricity=self.J42_batch(),
+            fuel_oil=self.J53_batch(),
+            propane=self.J57_batch(),
+            waste=self.J77_batch(),
+            flights=self.co2_emissions_caused_by_flights(),
+            food=self.co2_emissions_through_food_consumption(),
+            total=self.J82_batch(),
+        )
+
+    def calculate_batch(self, input_columns):
+        """vectorized counterpart of calculate() for N requests at once
+
+        input_columns maps any subset of the keys of input_labels_defaults to
+        sequences of length N (missing keys take their defaults).
+        Values are converted to float64, for which the result matches calculate()
+        bit for bit.
+
+        Returns a float64 array of N total carbon emissions in GtC/yr.
+        """
+        total_carbon_emissions = self.bind_columns(input_columns).J82_batch()
+        logging.info("EPAGHGCalculator: calculated batch of %d", len(total_carbon_emissions))
+        return total_carbon_emissions * self.poundsCO2eq_to_GtC
+
+    def calculate_breakdown_batch(self, input_columns):
+        """vectorized counterpart of calculate_breakdown(), one array of N values per category"""
+        return self.bind_columns(input_columns).breakdown_batch()
+
+
+emission_factor_names = frozenset(
+    name
+    for (name, value) in vars(EPAGHGCalculator).items()
+    if not name.startswith('_') and isinstance(value, (int, float)) and not isinstance(value, bool)
+)
+"""names of the class-level factors that EPAGHGCalculatorConfig.emission_factors may override"""
 
 default_ePACarbonFootprintCalculatorInput = {
     k: v[1]
@@ -517,14 +834,19 @@ default_ePACarbonFootprintCalculatorInput = {
 #     exit()
 
 
-def calculate_co2(sample):
-    epa_calculator = EPAGHGCalculator()
+co2_flights_average_km_and_costs = {
+    'short': {'kilometersPerTrip': 750, 'co2PerKilometerInKG': 0.088},
+    'medium': {'kilometersPerTrip': 2000, 'co2PerKilometerInKG': 0.088},
+    'long': {'kilometersPerTrip': 7500, 'co2PerKilometerInKG': 0.088}
+}
+"""flight table used by calculate_co2 and calculate_co2_batch"""
 
-    epa_calculator.flights_average_km_and_costs = {
-        'short': {'kilometersPerTrip': 750, 'co2PerKilometerInKG': 0.088},
-        'medium': {'kilometersPerTrip': 2000, 'co2PerKilometerInKG': 0.088},
-        'long': {'kilometersPerTrip': 7500, 'co2PerKilometerInKG': 0.088}
-    }
+co2_calculator = EPAGHGCalculator(EPAGHGCalculatorConfig(flights_average_km_and_costs=co2_flights_average_km_and_costs))
+"""calculator shared by calculate_co2 and its variants"""
+
+
+def calculate_co2(sample):
+    epa_calculator = co2_calculator
 
     footprint_list = []
 
@@ -558,3 +880,120 @@ def calculate_co2(sample):
         footprint_list.append(footprint)
 
     return footprint_list
+
+
+def co2_features(sample):
+    """checks a feature array, (N, 14) as built by build_vec or (N, 16) with padding, and returns it as float64"""
+    sample = np.asarray(sample, dtype=np.float64)
+    if sample.ndim != 2 or sample.shape[1] not in (14, 16):
+        raise ValueError("co2_features: expected a (N, 14) or (N, 16) array, got shape %s" % str(sample.shape))
+    return sample
+
+
+def co2_input_columns(sample):
+    """maps a (N, 14) or (N, 16) feature array onto input columns of EPAGHGCalculator, like calculate_co2"""
+    sample = co2_features(sample)
+
+    input_columns = dict()
+
+    # Recycling
+    # Transforms binary values into 1/2
+    input_columns["recyclePlasticF67"] = np.where(sample[:, 0] != 0, 1, 2)
+    input_columns["recycleGlassF69"] = np.where(sample[:, 1] != 0, 1, 2)
+    input_columns["recycleMagsF73"] = np.where(sample[:, 2] != 0, 1, 2)
+    input_columns["recycleNewspaperF71"] = np.where(sample[:, 3] != 0, 1, 2)
+    input_columns["recycleAluminumF65"] = np.where(sample[:, 4] != 0, 1, 2)
+
+    # Mobility
+    # Converts kilometers into miles
+    input_columns["vehicle1MilesD15"] = sample[:, 5] / 1.609
+
+    # Mobility (planes)
+    input_columns["mobility_airplane_short_flights"] = sample[:, 6]
+    input_columns["mobility_airplane_medium_flights"] = sample[:, 7]
+    input_columns["mobility_airplane_long_flights"] = sample[:, 8]
+
+    # Diet
+    input_columns["foodPreferences_vegan2MeatScale"] = sample[:, 13]
+
+    return input_columns
+
+
+def calculate_co2_batch(sample):
+    """vectorized calculate_co2 on a (N, 14) or (N, 16) feature array
+
+    Returns a float64 array of N footprints in GtC/yr, equal bit for bit to
+    calculate_co2 on the same sample as float64.
+    """
+    return co2_calculator.calculate_batch(co2_input_columns(sample))
+
+
+recycling_code_weights = 1 << np.arange(5)
+"""bit weights of the five recycling columns in the index of CompiledCO2Model.recycling_table"""
+
+
+class CompiledCO2Model:
+    """closed form of calculate_co2 for a fixed set of defaults and flight table
+
+    With everything but the sample fixed, the footprint is affine in car km,
+    the three flight counts and diet, plus a constant for each of the 32
+    combinations of the recycling booleans:
+
+        footprint = sample @ coefficients + recycling_table[recycling code]
+
+    Results agree with calculate_co2_batch up to floating point rounding.
+    """
+
+    def __init__(self, coefficients, recycling_table, key):
+        self.coefficients = coefficients
+        """(16,) footprint per unit of each feature, in GtC/yr"""
+        self.recycling_table = recycling_table
+        """(32,) footprint of a zero sample per recycling code, in GtC/yr"""
+        self.key = key
+        """EPAGHGCalculator.co2_model_key() the model was compiled with"""
+
+    def is_valid_for(self, epa_calculator):
+        return self.key == epa_calculator.co2_model_key()
+
+    def score(self, sample):
+        """footprints in GtC/yr of a (N, 14) or (N, 16) feature array"""
+        # The padding columns 14:16 have no coefficients
+        sample = co2_features(sample)[:, :14]
+        recycling_code = (sample[:, 0:5] != 0) @ recycling_code_weights
+        return sample @ self.coefficients[:14] + self.recycling_table[recycling_code]
+
+
+def compile_co2_model(epa_calculator):
+    """compiles calculate_co2 for the current defaults and flight table of epa_calculator
+
+    Evaluates the exact batch engine once per recycling combination and once
+    per linear feature.
+    """
+    recycling_samples = np.zeros((32, 16))
+    recycling_samples[:, 0:5] = (np.arange(32)[:, None] & recycling_code_weights) != 0
+
+    linear_features = [5, 6, 7, 8, 13]
+    linear_samples = np.zeros((len(linear_features), 16))
+    linear_samples[np.arange(len(linear_features)), linear_features] = 1.0
+
+    footprints = epa_calculator.calculate_batch(co2_input_columns(np.vstack([recycling_samples, linear_samples])))
+    recycling_table = footprints[:32]
+    coefficients = np.zeros(16)
+    coefficients[linear_features] = footprints[32:] - recycling_table[0]
+
+    return CompiledCO2Model(coefficients, recycling_table, epa_calculator.co2_model_key())
+
+
+_co2_model = None
+
+
+def calculate_co2_linear(sample):
+    """calculate_co2 on a (N, 14) or (N, 16) feature array through a CompiledCO2Model
+
+    The model is compiled on first use and recompiled whenever the defaults change.
+    """
+    global _co2_model
+    co2_model = _co2_model
+    if co2_model is None or not co2_model.is_valid_for(co2_calculator):
+        co2_model = _co2_model = compile_co2_model(co2_calculator)
+    return co2_model.score(sample)
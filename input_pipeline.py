@@ -0,0 +1,46 @@
+"""
+tf.data input pipeline serving (128, 16) windows for training the VAE
+"""
+import numpy as np
+import tensorflow as tf
+
+from preprocessing import WindowDataset
+
+
+def windows_dataset(source, batch_size=64, shuffle=True, seed=None, cache=False):
+    """Builds a tf.data.Dataset of (batch_size, 128, 16) windows
+
+    source is either a WindowDataset, whose windows are then generated on the
+    fly from the series of all agents, or an array of windows. Only window
+    positions are shuffled and batched; the windows of a batch are gathered in
+    parallel and prefetched while the model trains on the previous batch.
+
+    cache keeps the gathered batches in memory after the first epoch, which
+    only makes sense for datasets that are not shuffled, e.g. validation sets.
+    """
+    if cache and shuffle:
+        raise ValueError("windows_dataset: a cached dataset would repeat the order of its first epoch")
+
+    if isinstance(source, WindowDataset):
+        # Holds the daily series (128 times smaller than the windows) and the window starts
+        values = tf.constant(np.asarray(source.series, dtype=np.float32))
+        keys = source.index[:, 1]
+        offsets = tf.range(source.window_length, dtype=tf.int64)
+
+        def lookup(batch_keys):
+            return tf.gather(values, tf.expand_dims(batch_keys, -1) + offsets)
+    else:
+        values = tf.constant(np.asarray(source, dtype=np.float32))
+        keys = np.arange(len(source))
+
+        def lookup(batch_keys):
+            return tf.gather(values, batch_keys)
+
+    dataset = tf.data.Dataset.from_tensor_slices(keys.astype(np.int64))
+    if shuffle:
+        dataset = dataset.shuffle(len(keys), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size).map(lookup, num_parallel_calls=tf.data.AUTOTUNE)
+    if cache:
+        dataset = dataset.cache()
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,83 @@
+"""
+On-disk store of the latent space embeddings of the windows
+
+The encoder is run once per (encoder, dataset) pair; plots and analyses of the
+latent space read the memory-mapped z_mean and z_log_var instead of calling
+encoder.predict on the full dataset again.
+"""
+import hashlib
+import logging
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+from preprocessing import PreprocessingCache, save_array
+
+
+class Embeddings(NamedTuple):
+    """Latent space embeddings of the windows of a WindowDataset"""
+    z_mean: np.ndarray
+    z_log_var: np.ndarray
+    index: np.ndarray
+
+
+def model_hash(path):
+    """Content hash of a saved model, either a file or a SavedModel directory"""
+    digest = hashlib.blake2b(digest_size=16)
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+
+    for file in files:
+        digest.update(os.path.relpath(file, path).encode())
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def dataset_hash(dataset, chunk_size=1 << 16):
+    """Content hash of the windows of a WindowDataset: its index and its series"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(dataset.window_length).encode())
+    digest.update(np.ascontiguousarray(dataset.index).tobytes())
+    for i in range(0, len(dataset.series), chunk_size):
+        digest.update(np.ascontiguousarray(dataset.series[i:i + chunk_size]).tobytes())
+    return digest.hexdigest()
+
+
+class LatentCache:
+    """Embeddings of datasets, keyed by the content of the encoder and of the dataset
+
+    A retrained encoder or a rebuilt dataset therefore gets new embeddings;
+    like in PreprocessingCache, the stale entries are simply no longer read.
+    """
+
+    def __init__(self, directory="latent_cache"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, name):
+        return os.path.join(self.directory, "{}-{}.npy".format(key, name))
+
+    def embeddings(self, encoder_path, dataset, batch_size=1024, custom_objects=None):
+        """Returns the memory-mapped Embeddings of a WindowDataset, running the encoder if needed
+
+        custom_objects is passed to keras.models.load_model, e.g. {"Sampling": Sampling}.
+        """
+        key = PreprocessingCache.key(model_hash(encoder_path), dataset_hash(dataset))
+        names = Embeddings._fields
+
+        if not all(os.path.exists(self.path(key, name)) for name in names):
+            logging.info("LatentCache: encoding %d windows with %s", len(dataset), encoder_path)
+            from tensorflow import keras
+            from input_pipeline import windows_dataset
+
+            encoder = keras.models.load_model(encoder_path, custom_objects=custom_objects)
+            z_mean, z_log_var, _ = encoder.predict(windows_dataset(dataset, batch_size=batch_size, shuffle=False))
+            for name, array in zip(names, (z_mean, z_log_var, dataset.index)):
+                save_array(self.path(key, name), array)
+
+        return Embeddings(*(np.load(self.path(key, name), mmap_mode='r') for name in names))
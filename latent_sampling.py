@@ -0,0 +1,74 @@
+"""
+Sampling of the latent space and batched decoding of the samples
+
+The latent points are decoded in large chunks by a single compiled call of
+the decoder each, instead of one decoder.predict call per point, so that
+sampling many agents is bound by the decoder FLOPs rather than Python and
+Keras overhead. The decoded windows are yielded chunk by chunk, so that any
+number of agents can be generated in constant memory.
+"""
+import numpy as np
+from scipy.stats import norm
+
+
+def grid(n, latent_dim=2, low=0.01, high=0.99):
+    """Regular grid of n points per dimension, at the quantiles between low and high of the prior
+
+    Returns an (n ** latent_dim, latent_dim) array. With latent_dim 2, point
+    i * n + j is (grid_x[j], grid_y[i]), in the order of the loops
+    "for i, yi in enumerate(grid_y): for j, xi in enumerate(grid_x)".
+    """
+    values = norm.ppf(np.linspace(low, high, n))
+    return np.stack(np.meshgrid(*[values] * latent_dim), axis=-1).reshape(-1, latent_dim)
+
+
+def prior(n, latent_dim=2, chunk_size=8192, seed=None):
+    """Yields n draws from the standard normal prior, in (chunk_size, latent_dim) chunks"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, chunk_size):
+        yield rng.standard_normal((min(chunk_size, n - start), latent_dim), dtype=np.float32)
+
+
+def compile_decoder(decoder):
+    """Compiled decoder.__call__ taking and returning NumPy arrays
+
+    The input signature has an unknown batch size, so that chunks of any
+    size run the same graph.
+    """
+    # Imported here, so that decoders exported by decoder_export.py run without TensorFlow
+    import tensorflow as tf
+
+    latent_dim = decoder.input_shape[-1]
+
+    @tf.function(input_signature=[tf.TensorSpec((None, latent_dim), tf.float32)])
+    def call(z):
+        return decoder(z, training=False)
+
+    return lambda z: call(tf.convert_to_tensor(z, dtype=tf.float32)).numpy()
+
+
+def chunks(z, chunk_size=8192):
+    """Yields an array of latent points in chunks, or passes an iterable of chunks through"""
+    if isinstance(z, np.ndarray):
+        for start in range(0, len(z), chunk_size):
+            yield z[start:start + chunk_size]
+    else:
+        yield from z
+
+
+def decode(decoder, z, chunk_size=8192):
+    """Yields the (chunk, 128, 16) windows decoded from the latent points z
+
+    z is an (n, latent_dim) array, e.g. a grid, or an iterable of chunks,
+    e.g. prior(n); decoder is a Keras decoder, a compile_decoder function or
+    a decoder_export.NumpyDecoder.
+    """
+    if hasattr(decoder, "input_shape"):
+        decoder = compile_decoder(decoder)
+    for z_chunk in chunks(z, chunk_size):
+        yield decoder(z_chunk)
+
+
+def decode_all(decoder, z, chunk_size=8192):
+    """Decodes all latent points z into one (n, 128, 16) array"""
+    return np.concatenate(list(decode(decoder, z, chunk_size)))
@@ -0,0 +1,74 @@
+"""
+Loss of the VAE, shared by train_step and test_step of all models
+"""
+import tensorflow as tf
+
+epsilon = 1e-7
+"""Fuzz factor of the cross-entropies, as in keras.backend.epsilon()"""
+
+
+def vae_loss(data, reconstruction, z_mean, z_log_var, beta=1.0):
+    """Computes the losses of all feature groups and the KL divergence in one pass
+
+    The terms are the same as keras.losses.binary_crossentropy (recycling 0:5),
+    mean_squared_error (mobility 5:9, diet 13) and categorical_crossentropy
+    (Co2 poll 9:13). The function is not compiled itself, so that it is traced
+    into the step that calls it; see compiled_vae_loss.
+
+    The inputs are cast to float32, so that the loss stays in full precision
+    when the model runs with a mixed_bfloat16 policy.
+
+    Returns a dict of tensors: per-window "recycling", "mobility", "co2",
+    "reconstruction" and "total" losses of shape (batch,), and the scalar
+    "diet" and "kl" losses.
+    """
+    data = tf.cast(data, tf.float32)
+    reconstruction = tf.cast(reconstruction, tf.float32)
+    z_mean = tf.cast(z_mean, tf.float32)
+    z_log_var = tf.cast(z_log_var, tf.float32)
+
+    # Binary cross-entropy loss for recycling preferences
+    recycling_true = data[:, :, 0:5]
+    recycling_pred = tf.clip_by_value(reconstruction[:, :, 0:5], epsilon, 1. - epsilon)
+    recycling_bce = -(recycling_true * tf.math.log(recycling_pred + epsilon)
+                      + (1. - recycling_true) * tf.math.log(1. - recycling_pred + epsilon))
+    recycling_loss = tf.reduce_mean(recycling_bce, axis=[1, 2])
+
+    # MSE loss for mobility
+    mobility_loss = tf.reduce_mean(tf.square(data[:, :, 5:9] - reconstruction[:, :, 5:9]), axis=[1, 2])
+
+    # Categorical cross-entropy loss for Co2 votes
+    co2_pred = reconstruction[:, :, 9:13]
+    co2_pred = tf.clip_by_value(co2_pred / tf.reduce_sum(co2_pred, axis=-1, keepdims=True), epsilon, 1. - epsilon)
+    co2_loss = tf.reduce_mean(-tf.reduce_sum(data[:, :, 9:13] * tf.math.log(co2_pred), axis=-1), axis=1)
+
+    # MSE loss for diet preferences, summed over the batch
+    diet_loss = tf.reduce_sum(tf.reduce_mean(tf.square(data[:, :, 13] - reconstruction[:, :, 13]), axis=-1))
+
+    reconstruction_loss = recycling_loss + diet_loss + mobility_loss + co2_loss
+
+    kl_loss = -0.5 * (1 + z_log_var - tf.square(z_mean) - tf.exp(z_log_var))
+    kl_loss = beta * tf.reduce_mean(tf.reduce_sum(kl_loss, axis=1))
+
+    return {
+        "recycling": recycling_loss,
+        "mobility": mobility_loss,
+        "co2": co2_loss,
+        "diet": diet_loss,
+        "reconstruction": reconstruction_loss,
+        "kl": kl_loss,
+        "total": reconstruction_loss + kl_loss,
+    }
+
+
+compiled_vae_loss = tf.function(vae_loss, jit_compile=True)
+"""vae_loss compiled with XLA, which fuses the terms into a few kernels
+
+Only for steps that are not XLA-compiled themselves: nested in a
+jit-compiled step, it is compiled separately and slows every step down.
+"""
+
+
+def step_loss(jit_compile):
+    """The loss of a training or test step, given whether the step is compiled with XLA itself"""
+    return vae_loss if jit_compile else compiled_vae_loss
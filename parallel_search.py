@@ -0,0 +1,122 @@
+"""
+Runs the hyperparameter search of vae5_hyper.py with several local workers
+
+Keras Tuner coordinates the workers through an oracle served by a chief
+process over localhost. Each worker trains its own trials with a fixed number
+of TensorFlow threads, pinned to its own set of cores where supported.
+
+Usage: python parallel_search.py [--workers N] [--threads-per-worker T] [--port P] [vae5_hyper.py arguments]
+"""
+import argparse
+import functools
+import os
+import signal
+import subprocess
+import sys
+
+from training_config import add_arguments, from_args
+
+
+def worker_env(tuner_id, port, threads):
+    """Environment of a chief or worker process"""
+    env = dict(os.environ)
+    env["KERASTUNER_TUNER_ID"] = tuner_id
+    env["KERASTUNER_ORACLE_IP"] = "127.0.0.1"
+    env["KERASTUNER_ORACLE_PORT"] = str(port)
+
+    # Read by TensorFlow (and oneDNN) when the process starts
+    env["TF_NUM_INTRAOP_THREADS"] = str(threads)
+    env["TF_NUM_INTEROP_THREADS"] = "1"
+    env["OMP_NUM_THREADS"] = str(threads)
+    return env
+
+
+def available_cores():
+    """Cores this process may run on, e.g. within a cgroup or cpuset limit"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def _terminated(signum, frame):
+    # Unwinds launch, which terminates the chief and the workers
+    raise SystemExit(128 + signum)
+
+
+def launch(workers, threads_per_worker, port=8000, script="vae5_hyper.py", script_args=(), environ=None):
+    """Starts the chief and the workers, waits for them and returns their exit codes
+
+    environ holds additional environment variables of the workers, e.g. TrainingConfig.environ(); its
+    thread counts must match threads_per_worker, the number of cores each worker is pinned to. The
+    chief and the workers are terminated when launch is interrupted, or the launcher gets SIGTERM.
+    """
+    environ = environ or {}
+    for name in ("TF_NUM_INTRAOP_THREADS", "OMP_NUM_THREADS"):
+        if name in environ and int(environ[name]) != threads_per_worker:
+            raise ValueError("launch: {}={} conflicts with {} threads per worker".format(
+                name, environ[name], threads_per_worker))
+
+    command = [sys.executable, script] + list(script_args)
+    cores = available_cores()
+    processes = []
+    previous_handler = signal.signal(signal.SIGTERM, _terminated)
+    try:
+        processes.append(subprocess.Popen(command, env=worker_env("chief", port, 1)))
+
+        for i in range(workers):
+            env = worker_env("tuner{}".format(i), port, threads_per_worker)
+            env.update(environ)
+
+            # Pins each worker to its own cores before it starts, so that workers do not compete for them
+            preexec_fn = None
+            if hasattr(os, "sched_setaffinity"):
+                worker_cores = {cores[core % len(cores)]
+                                for core in range(i * threads_per_worker, (i + 1) * threads_per_worker)}
+                preexec_fn = functools.partial(os.sched_setaffinity, 0, worker_cores)
+            processes.append(subprocess.Popen(command, env=env, preexec_fn=preexec_fn))
+
+        codes = [process.wait() for process in processes[1:]]
+
+        # The chief serves the oracle until all workers are done
+        return [processes[0].wait()] + codes
+    except BaseException:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+        raise
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="threads and cores of each worker (default: --intra-op-threads, or 2)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of workers (default: cores / threads per worker)")
+    parser.add_argument("--port", type=int, default=8000)
+    # Other arguments, e.g. --validation-rate, are passed on to vae5_hyper.py
+    args, script_args = parser.parse_known_args()
+
+    # The training settings read by TensorFlow at startup, e.g. --no-onednn, go into the environment of the workers
+    training_parser = argparse.ArgumentParser(add_help=False)
+    add_arguments(training_parser)
+    training_args, _ = training_parser.parse_known_args(script_args)
+    environ = from_args(training_args).environ()
+
+    # Each worker is pinned to as many cores as it has intra-op threads
+    if (args.threads_per_worker and training_args.intra_op_threads
+            and args.threads_per_worker != training_args.intra_op_threads):
+        parser.error("--intra-op-threads {} conflicts with --threads-per-worker {}".format(
+            training_args.intra_op_threads, args.threads_per_worker))
+    threads_per_worker = args.threads_per_worker or training_args.intra_op_threads or 2
+
+    workers = args.workers or max(len(available_cores()) // threads_per_worker, 1)
+    codes = launch(workers, threads_per_worker, args.port, script_args=script_args, environ=environ)
+    sys.exit(max(codes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Distribution metrics comparing generated windows with the test set
+
+Replaces eyeballing the histograms of sample.org with numbers, for every
+feature and jointly:
+
+- the two-sample KS statistic and the Wasserstein distance of each feature
+- the distance of the correlation matrices of the features
+- the frequency error of the recycling choices and of the Co2 poll votes
+- the error of the autocorrelation of each feature over the 128 time steps
+
+The windows are read in chunks, in bounded memory. By default the metrics are
+sampled estimates: populations larger than max_windows (2*10^4) are evaluated
+on a random sample of their windows, and the KS statistics and Wasserstein
+distances on max_values (2*10^5) random values per feature. This takes a few
+seconds for 10^6 memory-mapped windows, whereas a full pass over them
+(--max-windows 0) takes minutes. The report records the sample sizes.
+
+The generated windows are read from a .npy file of (n, 128, 16) windows, or
+from the windows.npy written by population_synthesis.py --windows.
+
+Usage: python population_metrics.py generated [--test dataset_test] [--output report.json] [--max-windows N]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from agent_attributes import cutoff_value, recycling_names, vote_categories
+from preprocessing import WindowDataset, feature_columns, poll_values
+
+
+def ks_wasserstein(a, b):
+    """Two-sample KS statistics and Wasserstein distances of the columns of a and b
+
+    All columns are sorted in one call; the empirical CDFs are then compared
+    at all values of both samples, as in scipy.stats.ks_2samp and
+    scipy.stats.wasserstein_distance.
+    """
+    a = np.sort(np.asarray(a, dtype=np.float64), axis=0)
+    b = np.sort(np.asarray(b, dtype=np.float64), axis=0)
+
+    ks = np.empty(a.shape[1])
+    wasserstein = np.empty(a.shape[1])
+    for f in range(a.shape[1]):
+        values = np.sort(np.concatenate([a[:, f], b[:, f]]))
+        cdf_a = np.searchsorted(a[:, f], values, side="right") / len(a)
+        cdf_b = np.searchsorted(b[:, f], values, side="right") / len(b)
+        ks[f] = np.max(np.abs(cdf_a - cdf_b))
+        wasserstein[f] = np.sum(np.abs(cdf_a - cdf_b)[:-1] * np.diff(values))
+    return ks, wasserstein
+
+
+class WindowStatistics:
+    """Sums over windows, accumulated chunk by chunk, of the joint and temporal statistics"""
+
+    def __init__(self, lags=16):
+        self.lags = lags
+        features = len(feature_columns)
+        self.windows = 0
+        self.values = 0
+        self.sum = np.zeros(features)
+        self.products = np.zeros((features, features))
+        self.recycling = np.zeros(len(recycling_names))
+        self.votes = np.zeros(len(vote_categories))
+        self.autocorrelation = np.zeros((features, lags))
+        self.autocorrelation_windows = np.zeros((features, 1))
+        self.sample = None
+
+    def update(self, windows):
+        windows = np.asarray(windows, dtype=np.float32)[:, :, :len(feature_columns)]
+        n, length, features = windows.shape
+        values = windows.reshape(-1, features)
+
+        # Moments of the correlation matrix
+        self.windows += n
+        self.values += len(values)
+        self.sum += values.sum(axis=0, dtype=np.float64)
+        self.products += values.T.astype(np.float64) @ values
+
+        # Category frequencies, as decoded by agent_attributes.decode_attributes
+        self.recycling += (windows[:, :, 0:5] >= cutoff_value).sum(axis=(0, 1))
+        votes = len(poll_values) - 1 - np.argmax(windows[:, :, 9:13], axis=-1)
+        self.votes += np.bincount(votes.ravel(), minlength=len(poll_values))
+
+        # Autocorrelation of each window and feature; for a few lags the
+        # products of the shifted series are cheaper than an FFT
+        centered = windows.transpose(0, 2, 1) - windows.mean(axis=1)[:, :, None]
+        variance = np.einsum("nft,nft->nf", centered, centered) / length
+        valid = variance > 1e-12
+        for lag in range(1, self.lags + 1):
+            covariance = np.einsum("nft,nft->nf", centered[:, :, :-lag], centered[:, :, lag:]) / (length - lag)
+            self.autocorrelation[:, lag - 1] += np.divide(covariance, variance, out=np.zeros_like(covariance),
+                                                          where=valid).sum(axis=0)
+        self.autocorrelation_windows[:, 0] += valid.sum(axis=0)
+
+    def correlation(self):
+        mean = self.sum / self.values
+        covariance = self.products / self.values - np.outer(mean, mean)
+        deviation = np.sqrt(np.maximum(np.diag(covariance), 0))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            correlation = covariance / np.outer(deviation, deviation)
+        # Constant features, e.g. a recycling choice nobody makes, are uncorrelated
+        return np.nan_to_num(correlation)
+
+    def mean_autocorrelation(self):
+        """(14, lags) autocorrelations, averaged over the windows in which the feature varies"""
+        return self.autocorrelation / np.maximum(self.autocorrelation_windows, 1)
+
+
+def window_statistics(windows, max_windows=2 * 10 ** 4, max_values=2 * 10 ** 5, chunk_size=4096, lags=16, seed=42):
+    """WindowStatistics of up to max_windows random windows, read chunk_size at a time
+
+    max_windows or max_values of None evaluate all windows or values. The values of the features at up to max_values random (window, time step)
+    pairs of these windows are gathered in the same pass, into the
+    (max_values, 14) array statistics.sample.
+    """
+    rng = np.random.default_rng(seed)
+    n, length = len(windows), windows.shape[1]
+    selected = np.arange(n) if max_windows is None or n <= max_windows else np.sort(rng.choice(n, size=max_windows, replace=False))
+    if max_values is None or len(selected) * length <= max_values:
+        positions = np.arange(len(selected) * length)
+    else:
+        positions = np.sort(rng.choice(len(selected) * length, size=max_values, replace=False))
+    rows, steps = np.divmod(positions, length)
+
+    statistics = WindowStatistics(lags)
+    statistics.sample = np.empty((len(positions), len(feature_columns)), dtype=np.float32)
+    bounds = np.searchsorted(rows, np.arange(0, len(selected) + chunk_size, chunk_size))
+    for i, start in enumerate(range(0, len(selected), chunk_size)):
+        if len(selected) == n:
+            chunk = np.asarray(windows[start:start + chunk_size])
+        else:
+            chunk = np.asarray(windows[selected[start:start + chunk_size]])
+        statistics.update(chunk)
+        sampled = slice(bounds[i], bounds[i + 1])
+        statistics.sample[sampled] = chunk[rows[sampled] - start, steps[sampled], :len(feature_columns)]
+    return statistics
+
+
+def compare(real, generated, max_windows=2 * 10 ** 4, max_values=2 * 10 ** 5, chunk_size=4096, lags=16, seed=42):
+    """Report of the metrics of generated windows against real windows, as a JSON-serializable dict
+
+    real and generated are (n, 128, 16) arrays, memory-mapped arrays or
+    WindowDatasets. Larger populations are evaluated on max_windows random
+    windows, and the KS statistics and Wasserstein distances on max_values
+    random values per feature of these windows, so that the metrics are
+    sampled estimates; None evaluates all windows or values.
+    """
+    real_statistics = window_statistics(real, max_windows, max_values, chunk_size, lags, seed)
+    generated_statistics = window_statistics(generated, max_windows, max_values, chunk_size, lags, seed)
+    ks, wasserstein = ks_wasserstein(real_statistics.sample, generated_statistics.sample)
+
+    correlation_difference = real_statistics.correlation() - generated_statistics.correlation()
+    autocorrelation_error = np.mean(np.abs(real_statistics.mean_autocorrelation()
+                                           - generated_statistics.mean_autocorrelation()), axis=1)
+    recycling_error = np.abs(real_statistics.recycling / real_statistics.values
+                             - generated_statistics.recycling / generated_statistics.values)
+    vote_error = np.abs(real_statistics.votes / real_statistics.values
+                        - generated_statistics.votes / generated_statistics.values)
+
+    return {
+        "real_windows": len(real),
+        "generated_windows": len(generated),
+        # Sizes of the samples the metrics are estimated from
+        "sampled": (real_statistics.windows < len(real) or generated_statistics.windows < len(generated)
+                    or len(real_statistics.sample) < real_statistics.values
+                    or len(generated_statistics.sample) < generated_statistics.values),
+        "evaluated_windows": [real_statistics.windows, generated_statistics.windows],
+        "distribution_values": [len(real_statistics.sample), len(generated_statistics.sample)],
+        "features": {
+            name: {
+                "ks": float(ks[f]),
+                "wasserstein": float(wasserstein[f]),
+                "autocorrelation_error": float(autocorrelation_error[f]),
+            }
+            for f, name in enumerate(feature_columns)
+        },
+        "correlation_distance": float(np.linalg.norm(correlation_difference)),
+        "correlation_max_error": float(np.max(np.abs(correlation_difference))),
+        "recycling_frequency_error": {name: float(e) for name, e in zip(recycling_names, recycling_error)},
+        "vote_frequency_error": {name: float(e) for name, e in zip(vote_categories, vote_error)},
+        "vote_total_variation": float(vote_error.sum() / 2),
+        "mean_ks": float(np.mean(ks)),
+        "mean_wasserstein": float(np.mean(wasserstein)),
+        "mean_autocorrelation_error": float(np.mean(autocorrelation_error)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("generated", help=".npy file of generated (n, 128, 16) windows, or an output directory of "
+                                          "population_synthesis.py --windows")
+    parser.add_argument("--test", default="dataset_test", help="name of the window index of the test set")
+    parser.add_argument("--output", default="population_metrics.json")
+    parser.add_argument("--max-windows", type=int, default=2 * 10 ** 4,
+                        help="windows sampled from larger populations, 0 for all")
+    parser.add_argument("--max-values", type=int, default=2 * 10 ** 5,
+                        help="values per feature sampled for the KS statistic and the Wasserstein distance, 0 for all")
+    args = parser.parse_args()
+
+    generated = args.generated
+    if os.path.isdir(generated):
+        generated = os.path.join(generated, "windows.npy")
+    report = compare(WindowDataset.load(args.test), np.load(generated, mmap_mode='r'),
+                     args.max_windows or None, args.max_values or None)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({name: value for name, value in report.items()
+                      if name.startswith(("sampled", "mean", "correlation", "vote_total"))}))
+
+
+if __name__ == "__main__":
+    main()
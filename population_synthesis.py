@@ -0,0 +1,230 @@
+"""
+Streaming synthesis of agent populations: latent draws -> decoder -> attributes -> GHG footprints
+
+The stages run concurrently in threads connected by bounded queues: the
+decoder (which runs its own TensorFlow threads) works on the next chunk while
+the attributes and footprints of the previous chunks are computed, and while
+they are written to disk. Only a few chunks are in memory at any time, so the
+population size is only bound by the disk.
+
+Usage: python population_synthesis.py decoder output_directory [--agents N] [--grid N] [--seed S] [--windows]
+"""
+import argparse
+import os
+import queue
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+from agent_attributes import AgentAttributes, decode_attributes, load_mobility_max
+from decoder_export import NumpyDecoder, load_decoder
+from epa_ghg_calculator import calculate_co2_linear
+from latent_sampling import chunks, compile_decoder, grid, prior
+from preprocessing import mobility_columns
+
+mobility_indices = np.arange(5, 5 + len(mobility_columns))
+"""Columns of the mobility features in the (128, 16) windows"""
+
+
+class PopulationChunk(NamedTuple):
+    """Consecutive agents of a population, starting at agent start"""
+    start: int
+    z: np.ndarray
+    attributes: AgentAttributes
+    footprints: np.ndarray
+    windows: np.ndarray = None
+    """(n, 128, 16) decoded windows, if synthesize is called with keep_windows"""
+
+
+def footprint_features(samples, mobility_max):
+    """(n, 16) features of the footprint calculation: the mean over time of the windows, with km and flights rescaled"""
+    features = np.mean(samples, axis=1, dtype=np.float64)
+    features[:, mobility_indices] *= np.asarray(mobility_max, dtype=np.float64)
+    return features
+
+
+_done = object()
+"""Marks the end of the items of a queue"""
+
+
+def _put(items, item, stop):
+    # Gives up when the pipeline is stopped, rather than blocking on a full queue forever
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _stage(function, inputs, outputs, stop, producers=1):
+    """Applies function to the items of inputs until all producers are done; errors are passed on"""
+    try:
+        done = 0
+        while done < producers and not stop.is_set():
+            # Polls, as producers give up without an end marker when the pipeline is stopped
+            try:
+                item = inputs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _done:
+                done += 1
+            elif isinstance(item, BaseException):
+                _put(outputs, item, stop)
+            else:
+                _put(outputs, function(item), stop)
+    except BaseException as e:
+        _put(outputs, e, stop)
+    finally:
+        _put(outputs, _done, stop)
+
+
+def synthesize(decoder, z, mobility_max, chunk_size=8192, workers=2, queue_size=2, footprint=calculate_co2_linear,
+               keep_windows=False):
+    """Yields the PopulationChunks of the agents decoded from the latent points z
+
+    z is an (n, latent_dim) array or an iterable of chunks, see
+    latent_sampling.prior and latent_sampling.grid; decoder is a Keras
+    decoder, a compile_decoder function or a decoder_export.NumpyDecoder. Attributes and footprints are
+    computed by workers threads, so chunks may be yielded out of order. With
+    keep_windows, the chunks also hold the decoded windows, e.g. for
+    population_metrics.py.
+    """
+    if hasattr(decoder, "input_shape"):
+        decoder = compile_decoder(decoder)
+
+    def draw():
+        start = 0
+        for z_chunk in chunks(z, chunk_size):
+            yield start, z_chunk
+            start += len(z_chunk)
+
+    def decode(item):
+        start, z_chunk = item
+        return start, z_chunk, decoder(z_chunk)
+
+    def convert(item):
+        start, z_chunk, samples = item
+        return PopulationChunk(start,
+                               z_chunk,
+                               decode_attributes(samples, mobility_max),
+                               footprint(footprint_features(samples, mobility_max)),
+                               samples if keep_windows else None)
+
+    stop = threading.Event()
+    latent = queue.Queue(queue_size)
+    decoded = queue.Queue(queue_size)
+    converted = queue.Queue(queue_size)
+
+    def produce():
+        try:
+            for item in draw():
+                _put(latent, item, stop)
+        except BaseException as e:
+            _put(latent, e, stop)
+        finally:
+            _put(latent, _done, stop)
+
+    def decode_stage():
+        _stage(decode, latent, decoded, stop)
+        # Every worker stops at its own end marker
+        for _ in range(workers - 1):
+            _put(decoded, _done, stop)
+
+    threads = [threading.Thread(target=produce, daemon=True),
+               threading.Thread(target=decode_stage, daemon=True)]
+    threads += [threading.Thread(target=_stage, args=(convert, decoded, converted, stop), daemon=True)
+                for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        done = 0
+        while done < workers:
+            item = converted.get()
+            if item is _done:
+                done += 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+def write_population(directory, population, n, latent_dim=2, windows=False):
+    """Writes the PopulationChunks of n agents to .npy files in directory, as they arrive
+
+    The files are memory-mapped, so that only the chunks in flight are kept in
+    memory; they get their final names once all agents are written. With
+    windows, the decoded windows of the chunks are written to windows.npy.
+    """
+    os.makedirs(directory, exist_ok=True)
+    shapes = {
+        "z": ((n, latent_dim), np.float32),
+        "recycling": ((n, 128, 5), np.bool_),
+        "car_km": ((n, 128), np.float32),
+        "flights": ((n, 128, 3), np.int32),
+        "vote": ((n, 128), np.int8),
+        "diet": ((n, 128), np.float32),
+        "footprint": ((n,), np.float64),
+    }
+    if windows:
+        shapes["windows"] = ((n, 128, 16), np.float32)
+    paths = {name: os.path.join(directory, name + ".npy") for name in shapes}
+    arrays = {name: np.lib.format.open_memmap(paths[name] + ".tmp", mode="w+", dtype=dtype, shape=shape)
+              for name, (shape, dtype) in shapes.items()}
+
+    written = 0
+    for chunk in population:
+        end = chunk.start + len(chunk.z)
+        arrays["z"][chunk.start:end] = chunk.z
+        for name, values in chunk.attributes._asdict().items():
+            arrays[name][chunk.start:end] = values
+        arrays["footprint"][chunk.start:end] = chunk.footprints
+        if windows:
+            arrays["windows"][chunk.start:end] = chunk.windows
+        written += len(chunk.z)
+
+    if written != n:
+        raise ValueError("write_population: expected {} agents, got {}".format(n, written))
+
+    for name, array in arrays.items():
+        array.flush()
+        os.replace(paths[name] + ".tmp", paths[name])
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("decoder", help="saved Keras decoder, e.g. decoder_hyper_2.pb, or .npz export of decoder_export.py")
+    parser.add_argument("output_directory")
+    parser.add_argument("--agents", type=int, default=10 ** 6, help="number of agents drawn from the prior")
+    parser.add_argument("--grid", type=int, default=None,
+                        help="decodes a grid of N points per latent dimension instead of prior draws")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=8192)
+    parser.add_argument("--workers", type=int, default=max(min(os.cpu_count() - 1, 4), 1))
+    parser.add_argument("--mobility-max", default="dataset_mobility_max.p")
+    parser.add_argument("--windows", action="store_true",
+                        help="also writes the decoded windows to windows.npy, for population_metrics.py")
+    args = parser.parse_args()
+
+    decoder = load_decoder(args.decoder)
+    latent_dim = decoder.latent_dim if isinstance(decoder, NumpyDecoder) else decoder.input_shape[-1]
+
+    if args.grid:
+        z = grid(args.grid, latent_dim)
+        n = len(z)
+    else:
+        z = prior(args.agents, latent_dim, args.chunk_size, args.seed)
+        n = args.agents
+
+    population = synthesize(decoder, z, load_mobility_max(args.mobility_max), args.chunk_size, args.workers,
+                            keep_windows=args.windows)
+    write_population(args.output_directory, population, n, latent_dim, args.windows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+"""
+Data preprocessing of the SCIARA simulation dumps, see preparation.org
+
+The functions live in a module (rather than only in the org session) so that
+worker processes of preprocess() can import them.
+"""
+import collections
+import hashlib
+import itertools
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import bson
+import numpy as np
+import pandas as pd
+
+feature_columns = [
+    'recycling_plastic',
+    'recycling_glass',
+    'recycling_magazines',
+    'recycling_newspapers',
+    'recycling_metals',
+    'mobility_car',
+    'mobility_plane0',
+    'mobility_plane1',
+    'mobility_plane2',
+    'co2_poll_raise',
+    'co2_poll_maintain',
+    'co2_poll_lower',
+    'co2_poll_abstain',
+    'diet'
+]
+
+dataset_root = "../datasets"
+"""Directory containing one subdirectory per simulation dump"""
+
+
+def build_vec(s):
+    variables = s['variables']
+
+    return [
+        # General metadata
+        s['agentStateId'],
+        s['simulationTime'],
+
+        # Recycling (0:5)
+        float(variables['recyclingSelection']['plastic']),
+        float(variables['recyclingSelection']['glass']),
+        float(variables['recyclingSelection']['magazines']),
+        float(variables['recyclingSelection']['newspapers']),
+        float(variables['recyclingSelection']['aluminumAndSteel']),
+
+        # Mobility (5:9)
+        float(variables['mobility']['car']['annualKilometersByCar']),
+        float(variables['mobility']['airplane'][0]['numberTrips']),
+        float(variables['mobility']['airplane'][1]['numberTrips']),
+        float(variables['mobility']['airplane'][2]['numberTrips']),
+
+        # Co2 Poll (9:13)
+        float(variables['votings'][0]['value'] == "raise"),
+        float(variables['votings'][0]['value'] == "maintain"),
+        float(variables['votings'][0]['value'] == "lower"),
+        float(variables['votings'][0]['value'] == "abstain"),
+
+        # Diet (13:14)
+        float(variables['foodPreferences']['vegan2MeatScale']),
+    ]
+
+
+def filter_agents(agent_states, selection):
+    return (s for s in agent_states if 'simulationTime' in s and s['agentStateId'] in selection)
+
+
+poll_values = ["raise", "maintain", "lower", "abstain"]
+"""Values of the Co2 poll, in the order of the one-hot columns"""
+
+poll_codes = {value: code for code, value in enumerate(poll_values)}
+
+poll_one_hot = np.vstack([np.eye(len(poll_values)), np.zeros(len(poll_values))])
+"""One-hot rows per poll code; the last row is for unknown values, which build_vec encodes as zeros"""
+
+
+def extract_columns(agent_states):
+    """Columnar counterpart of build_vec for a list of documents
+
+    The fields of each document are written straight into a preallocated
+    (n, 14) feature array, and the Co2 poll is one-hot encoded from an array
+    of category codes for the whole batch. Returns the agent ids, the
+    simulation times and the (n, 14) features in the layout of build_vec.
+
+    Unlike build_vec, which passes NaN values through, documents with NaN or
+    None fields are rejected with a ValueError, so that they do not reach the
+    resampled series and the training windows.
+    """
+    n = len(agent_states)
+    features = np.empty((n, len(feature_columns)), dtype=np.float64)
+    poll = np.empty(n, dtype=np.intp)
+    unknown_poll = len(poll_values)
+
+    for i, s in enumerate(agent_states):
+        v = s['variables']
+        recycling = v['recyclingSelection']
+        mobility = v['mobility']
+        airplane = mobility['airplane']
+
+        # Recycling (0:5) and mobility (5:9)
+        features[i, 0:9] = (
+            recycling['plastic'],
+            recycling['glass'],
+            recycling['magazines'],
+            recycling['newspapers'],
+            recycling['aluminumAndSteel'],
+            mobility['car']['annualKilometersByCar'],
+            airplane[0]['numberTrips'],
+            airplane[1]['numberTrips'],
+            airplane[2]['numberTrips'],
+        )
+
+        # Diet (13:14)
+        features[i, 13] = v['foodPreferences']['vegan2MeatScale']
+
+        poll[i] = poll_codes.get(v['votings'][0]['value'], unknown_poll)
+
+    # Co2 Poll (9:13)
+    features[:, 9:13] = poll_one_hot[poll]
+
+    # None fields become NaN in the conversion
+    missing = np.isnan(features).any(axis=1)
+    if missing.any():
+        raise ValueError("extract_columns: missing values in the agent state {}".format(
+            agent_states[int(np.argmax(missing))]['agentStateId']))
+
+    aids = np.fromiter((s['agentStateId'] for s in agent_states), dtype=np.int64, count=n)
+    simulation_times = pd.to_datetime([s['simulationTime'] for s in agent_states]).to_numpy().astype('datetime64[ms]')
+
+    return aids, simulation_times, features
+
+
+def read_columns(agent_states, capacity=65536, chunk_size=16384):
+    """Writes the vectors of agent_states into typed column arrays, which grow as needed
+
+    The documents are converted chunk by chunk with extract_columns.
+    """
+    aids = np.empty(capacity, dtype=np.int64)
+    simulation_times = np.empty(capacity, dtype='datetime64[ms]')
+    features = np.empty((capacity, len(feature_columns)), dtype=np.float64)
+
+    n = 0
+    agent_states = iter(agent_states)
+    while True:
+        chunk = list(itertools.islice(agent_states, chunk_size))
+        if not chunk:
+            break
+
+        while n + len(chunk) > len(aids):
+            aids, simulation_times, features = [
+                np.concatenate([c, np.empty_like(c)]) for c in (aids, simulation_times, features)
+            ]
+
+        chunk_aids, chunk_simulation_times, chunk_features = extract_columns(chunk)
+        aids[n:n + len(chunk)] = chunk_aids
+        simulation_times[n:n + len(chunk)] = chunk_simulation_times
+        features[n:n + len(chunk)] = chunk_features
+        n += len(chunk)
+
+    return aids[:n], simulation_times[:n], features[:n]
+
+
+def load_agent_states(path, agents):
+    """Loads the states of the selected agents from a dump, before resampling"""
+    table = "agent_variables_state"
+
+    # Decodes the dump document by document and keeps only the selected agents
+    bson_opts = bson.CodecOptions(document_class=collections.OrderedDict, unicode_decode_error_handler="ignore")
+    with open("{}/{}/{}.bson".format(dataset_root, path, table), "rb") as agent_state_file:
+        agent_states = bson.decode_file_iter(agent_state_file, bson_opts)
+        agent_states = filter_agents(agent_states, set(agents))
+        aids, simulation_times, features = read_columns(agent_states)
+
+    # Builds the dataframe
+    agent_states_df = pd.DataFrame(features, columns=feature_columns)
+    agent_states_df.insert(0, 'simulation_time', simulation_times)
+    agent_states_df.insert(0, 'aid', aids)
+
+    # Duplicate simulation times are dropped across the whole dump, as before
+    return agent_states_df.drop_duplicates(subset="simulation_time")
+
+
+def resample_agent(agent_states_df):
+    """Resamples the states of a single agent to one row per simulation day"""
+    df_resampled = agent_states_df.set_index("simulation_time").resample("D")
+    df_interpolated = df_resampled.ffill().dropna()
+    df_interpolated.reset_index(drop=True, inplace=True)
+
+    return df_interpolated
+
+
+def load_dataset(path, agents):
+    """Loads and resamples the selected agents of a single dump"""
+    agent_states_df = load_agent_states(path, agents)
+
+    return pd.concat(
+        [resample_agent(data) for aid, data in agent_states_df.groupby("aid")],
+        ignore_index=True
+    )
+
+
+def preprocess_dumps(dumps, processes=None):
+    """Loads and resamples several dumps in parallel, returning one dataframe per dump
+
+    dumps is a list of (dump path, agent selection) pairs. Each dump is decoded
+    by its own worker; the per-agent resampling is then spread over the same
+    pool. Each dataframe has the same row order as load_dataset() on its dump.
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        loading = [pool.submit(load_agent_states, path, agents) for path, agents in dumps]
+
+        resampling = []
+        for future in loading:
+            agent_states_df = future.result()
+            resampling.append([
+                pool.submit(resample_agent, data) for aid, data in agent_states_df.groupby("aid")
+            ])
+
+        return [pd.concat([future.result() for future in futures], ignore_index=True) for futures in resampling]
+
+
+def preprocess(dumps, processes=None):
+    """Loads and resamples several dumps in parallel
+
+    The result has the same row order as loading the dumps one after another
+    with load_dataset() and concatenating them.
+    """
+    return pd.concat(preprocess_dumps(dumps, processes), ignore_index=True)
+
+
+window_length = 128
+"""Number of simulation days per window"""
+
+
+def build_series(df_normalized, window_length=window_length):
+    """Concatenates the daily series of all agents for memory-mapped storage
+
+    df_normalized holds the normalized features and padding columns of each
+    agent. Returns the (T, 16) float32 series of all agents, one after another,
+    and the (N, 2) index of windows, holding the agent id and the row of the
+    series at which each window starts.
+    """
+    series_list = []
+    index_list = []
+    offset = 0
+
+    for aid, data in df_normalized.groupby('aid'):
+        aid_np = data.reset_index(drop=True).drop('aid', axis=1).to_numpy().astype('float32')
+        series_list.append(aid_np)
+
+        # Every day that is followed by window_length - 1 further days starts a window
+        starts = offset + np.arange(max(len(aid_np) - window_length + 1, 0))
+        index_list.append(np.stack([np.full(len(starts), aid), starts], axis=1))
+        offset += len(aid_np)
+
+    return np.vstack(series_list), np.vstack(index_list).astype(np.int64)
+
+
+class WindowDataset:
+    """Sliding windows over a (memory-mapped) series, produced on demand
+
+    Indexing returns the windows of the given positions in the index as a
+    (n, window_length, 16) array; only those windows are read from the series.
+    """
+
+    def __init__(self, series, index, window_length=window_length):
+        self.series = series
+        self.index = index
+        self.window_length = window_length
+        self.offsets = np.arange(window_length)
+
+    @classmethod
+    def load(cls, name, series_path="dataset_series.npy"):
+        """Loads the window index "{name}_index.npy" over the memory-mapped series"""
+        return cls(np.load(series_path, mmap_mode='r'), np.load("{}_index.npy".format(name)))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        starts = self.index[key, 1]
+        return np.asarray(self.series[np.expand_dims(starts, -1) + self.offsets])
+
+    def __array__(self, dtype=None, copy=None):
+        windows = self[:]
+        return windows if dtype is None else windows.astype(dtype)
+
+    @property
+    def shape(self):
+        return (len(self), self.window_length, self.series.shape[1])
+
+    def subsample(self, rate, seed=None):
+        """WindowDataset over a random fraction rate of the windows, sharing the series"""
+        rng = np.random.default_rng(seed)
+        positions = np.sort(rng.choice(len(self), size=max(int(round(rate * len(self))), 1), replace=False))
+        return WindowDataset(self.series, self.index[positions], self.window_length)
+
+    def batches(self, batch_size, shuffle=False, seed=None):
+        """Yields the windows in batches of batch_size, optionally in random order"""
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+
+        for i in range(0, len(order), batch_size):
+            # Sorted positions read the memory-mapped series front to back
+            yield self[np.sort(order[i:i + batch_size])]
+
+
+mobility_columns = ['mobility_car', 'mobility_plane0', 'mobility_plane1', 'mobility_plane2']
+"""Numerical features that are scaled by their maximum"""
+
+
+def normalize(df_interpolated, mobility_max):
+    """Scales the mobility features by mobility_max and adds the padding features"""
+    df_normalized = df_interpolated.copy()
+    for column, column_max in zip(mobility_columns, mobility_max):
+        df_normalized[column] /= column_max
+
+    df_normalized["pad0"] = 0.0
+    df_normalized["pad1"] = 0.0
+
+    return df_normalized
+
+
+def dump_hash(path):
+    """Content hash of the agent states of a dump"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open("{}/{}/agent_variables_state.bson".format(dataset_root, path), "rb") as agent_state_file:
+        for block in iter(lambda: agent_state_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_array(path, array):
+    """np.save through a temporary file, so an interrupted run leaves no broken file"""
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+class PreprocessingCache:
+    """On-disk cache of the preprocessing stages
+
+    Each entry is keyed by a hash of everything it was computed from, so stale
+    entries are never read; they are simply no longer used.
+    """
+
+    def __init__(self, directory="preprocessing_cache"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Hash of JSON-serializable parts"""
+        return hashlib.blake2b(json.dumps(parts, default=str).encode(), digest_size=16).hexdigest()
+
+    def path(self, stage, key, suffix=".p"):
+        return os.path.join(self.directory, "{}-{}{}".format(stage, key, suffix))
+
+    def load(self, stage, key):
+        """Returns the cached object, or None"""
+        try:
+            with open(self.path(stage, key), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, stage, key, obj):
+        # Writes to a temporary file first, so an interrupted run leaves no broken entry
+        path = self.path(stage, key)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(obj, f)
+        os.replace(path + ".tmp", path)
+
+
+def load_daily_series(dumps, cache, processes=None):
+    """Resampled daily series per dump, decoding only dumps that are not cached yet
+
+    Returns a list of (cache key, dataframe, per-dump mobility maxima) per dump.
+    """
+    keys = [cache.key("daily", dump_hash(path), sorted(agents)) for path, agents in dumps]
+    entries = [cache.load("daily", key) for key in keys]
+
+    missing = [i for i, entry in enumerate(entries) if entry is None]
+    if missing:
+        for i, df in zip(missing, preprocess_dumps([dumps[i] for i in missing], processes)):
+            entries[i] = (df, [float(df[column].max()) for column in mobility_columns])
+            cache.save("daily", keys[i], entries[i])
+
+    return [(key, df, dump_max) for key, (df, dump_max) in zip(keys, entries)]
+
+
+def build_dataset(dumps, window_length=window_length, cache_directory="preprocessing_cache", processes=None):
+    """Cached preprocessing pipeline from simulation dumps to the window index
+
+    Stages are recomputed only if their inputs changed: a dump is decoded and
+    resampled only if its content or agent selection is new, the scaling
+    factors are the maximum of the cached per-dump maxima, and the series and
+    window index are rebuilt only for a new combination of daily series,
+    scaling factors and window length.
+
+    Returns the series, the window index (see build_series) and mobility_max.
+    """
+    cache = PreprocessingCache(cache_directory)
+    daily = load_daily_series(dumps, cache, processes)
+
+    mobility_max = np.max([dump_max for key, df, dump_max in daily], axis=0).tolist()
+
+    key = cache.key("windows", [key for key, df, dump_max in daily], mobility_max, window_length)
+    series_path = cache.path("windows", key, "_series.npy")
+    index_path = cache.path("windows", key, "_index.npy")
+
+    if not (os.path.exists(series_path) and os.path.exists(index_path)):
+        df_interpolated = pd.concat([df for key, df, dump_max in daily], ignore_index=True)
+        series, window_index = build_series(normalize(df_interpolated, mobility_max), window_length)
+
+        save_array(index_path, window_index)
+        save_array(series_path, series)
+
+    return np.load(series_path, mmap_mode='r'), np.load(index_path), mobility_max
@@ -0,0 +1,22 @@
+import numpy as np
+
+from agent_attributes import cutoff_value, decode_attributes, vote_categories
+
+
+def test_matches_per_step_conversion():
+    samples = np.random.default_rng(0).random((6, 128, 16), dtype=np.float32)
+    samples[0, :, 0] = cutoff_value
+    mobility_max = [30000., 12., 8., 4.]
+    attributes = decode_attributes(samples, mobility_max)
+
+    # The conversions of sample.org, one time step at a time
+    for sample, recycling, car_km, flights, vote, diet in zip(samples, *attributes):
+        np.testing.assert_array_equal(recycling, [[int(p[k] >= cutoff_value) for k in range(5)] for p in sample])
+        np.testing.assert_allclose(car_km, [s[5] * mobility_max[0] for s in sample], rtol=1e-6)
+        np.testing.assert_array_equal(flights, [[int(round(s[6 + k] * mobility_max[1 + k])) for k in range(3)]
+                                                for s in sample])
+        np.testing.assert_array_equal(vote, [3 - i for i in np.argmax(sample[:, 9:13], axis=1)])
+        np.testing.assert_array_equal(diet, [p[13] for p in sample])
+
+    assert vote_categories == ["abstain", "lower", "maintain", "raise"]
+    assert [a.dtype for a in attributes] == [bool, np.float32, np.int32, np.int8, np.float32]
@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+import numpy as np
+
+from agent_server import AgentServer
+
+
+def decoder(z):
+    return np.full((len(z), 128, 16), 0.25, dtype=np.float32)
+
+
+async def request(port, head):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(head.encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode().partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = json.loads(await reader.readexactly(int(headers["content-length"])))
+    writer.close()
+    return status, body
+
+
+def serve(*heads):
+    async def run():
+        server = AgentServer(decoder, [30000., 12., 8., 4.], seed=0)
+        tcp_server = await server.start(port=0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        try:
+            return [await asyncio.wait_for(request(port, head), 10) for head in heads]
+        finally:
+            tcp_server.close()
+
+    return asyncio.run(run())
+
+
+def test_agents():
+    [(status, body)] = serve("GET /agents?n=3 HTTP/1.1\r\n\r\n")
+    assert status == 200
+    assert len(body["footprint"]) == 3
+    assert np.array(body["recycling"]).shape == (3, 128, 5)
+
+
+def test_invalid_content_length():
+    responses = serve("GET /agents?n=1 HTTP/1.1\r\nContent-Length: abc\r\n\r\n",
+                      "GET /agents?n=1 HTTP/1.1\r\nContent-Length: -5\r\n\r\n")
+    assert [status for status, _ in responses] == [400, 400]
+
+
+def test_metrics_method():
+    [(post, _), (get, body)] = serve("POST /metrics HTTP/1.1\r\nContent-Length: 0\r\n\r\n",
+                                     "GET /metrics HTTP/1.1\r\n\r\n")
+    assert post == 405
+    assert get == 200
+    assert "latency_p50_ms" in body
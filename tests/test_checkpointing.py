@@ -0,0 +1,41 @@
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from checkpointing import Checkpointer
+
+
+def model():
+    model = keras.Sequential([keras.Input((4,)), keras.layers.Dense(3)])
+    model.compile(optimizer="adam", loss="mse")
+    return model
+
+
+def test_checkpoints_written_in_background(tmp_path, monkeypatch):
+    copy = tf.io.gfile.copy
+    threads = []
+
+    def recording_copy(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return copy(*args, **kwargs)
+
+    monkeypatch.setattr(tf.io.gfile, "copy", recording_copy)
+
+    trained = model()
+    checkpointer = Checkpointer(trained, str(tmp_path), max_to_keep=2)
+    assert checkpointer.restore() == 0
+    trained.fit(np.ones((8, 4)), np.ones((8, 3)), epochs=3, callbacks=[checkpointer], verbose=0)
+
+    # The files are written by the writer thread, not the training thread
+    assert threads and all(thread.name == "Checkpointer" for thread in threads)
+    assert checkpointer.latest_checkpoint == os.path.join(str(tmp_path), "ckpt-3")
+    assert not tf.io.gfile.glob(os.path.join(str(tmp_path), "ckpt-1.*"))
+    assert tf.io.gfile.glob(os.path.join(str(tmp_path), "ckpt-2.*"))
+
+    restored = model()
+    assert Checkpointer(restored, str(tmp_path)).restore() == 3
+    for value, expected in zip(restored.get_weights(), trained.get_weights()):
+        np.testing.assert_array_equal(value, expected)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from tensorflow import keras
+
+from decoder_export import NumpyDecoder, export_decoder
+
+
+def build_decoder(kernel_sizes=(3,), strides=1):
+    keras.utils.set_random_seed(0)
+    latent_inputs = keras.Input(shape=(2,))
+    x = keras.layers.Dense(2048, activation="relu")(latent_inputs)
+    x = keras.layers.Reshape((128, 16))(x)
+    for kernel_size in kernel_sizes[:-1]:
+        x = keras.layers.Conv1DTranspose(16, kernel_size, activation="relu", padding="same")(x)
+    outputs = keras.layers.Conv1DTranspose(16, kernel_sizes[-1], activation="sigmoid", padding="same",
+                                           strides=strides)(x)
+    return keras.Model(latent_inputs, outputs)
+
+
+@pytest.mark.parametrize("kernel_sizes", [(3,), (4,), (5, 2)])
+def test_matches_keras(tmp_path, kernel_sizes):
+    decoder = build_decoder(kernel_sizes)
+    export_decoder(decoder, str(tmp_path / "decoder.npz"))
+    numpy_decoder = NumpyDecoder(str(tmp_path / "decoder.npz"), chunk_size=64)
+
+    z = np.random.default_rng(0).standard_normal((300, 2)).astype(np.float32) * 3
+    expected = decoder.predict(z, verbose=0)
+    outputs = numpy_decoder(z)
+    assert outputs.shape == (300, 128, 16) and outputs.dtype == np.float32
+    np.testing.assert_allclose(outputs, expected, atol=1e-5)
+
+
+def test_unsupported_stride(tmp_path):
+    with pytest.raises(ValueError, match="stride"):
+        export_decoder(build_decoder(strides=2), str(tmp_path / "decoder.npz"))
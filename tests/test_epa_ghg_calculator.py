@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from epa_ghg_calculator import EPAGHGCalculator, EPAGHGCalculatorConfig, calculate_co2_batch, calculate_co2_linear, co2_calculator
+
+
+def features(n, columns):
+    rng = np.random.default_rng(0)
+    sample = np.zeros((n, columns))
+    sample[:, 0:5] = rng.random((n, 5)) < 0.5
+    sample[:, 5] = rng.random(n) * 30000
+    sample[:, 6:9] = rng.integers(0, 10, (n, 3))
+    sample[np.arange(n), 9 + rng.integers(0, 4, n)] = 1
+    sample[:, 13] = rng.random(n)
+    return sample
+
+
+def test_linear_matches_batch():
+    sample = features(100, 16)
+    np.testing.assert_allclose(calculate_co2_linear(sample), calculate_co2_batch(sample), rtol=1e-9)
+
+
+def test_14_columns():
+    sample = features(100, 16)
+    np.testing.assert_allclose(calculate_co2_linear(sample[:, :14]), calculate_co2_linear(sample), rtol=1e-12)
+    np.testing.assert_array_equal(calculate_co2_batch(sample[:, :14]), calculate_co2_batch(sample))
+
+
+def test_invalid_columns():
+    with pytest.raises(ValueError):
+        calculate_co2_linear(features(10, 16)[:, :13])
+
+
+def random_input_columns(n, seed=0):
+    """Random float64 columns of all inputs of EPAGHGCalculator, with valid codes for the categorical ones"""
+    rng = np.random.default_rng(seed)
+    codes = {
+        "primaryHeatingSourceF7": 6,
+        "vehicle1MilesUnitG15": 2,
+        "vehicleMaintenanceF29": 2,
+        "naturalGasUnitH37": 3,
+        "electricityUnitH42": 2,
+        "greenPowerF45": 2,
+        "fuelOilUnitH53": 2,
+        "propaneUnitH57": 2,
+        "recycleAluminumF65": 2,
+        "recyclePlasticF67": 2,
+        "recycleGlassF69": 2,
+        "recycleNewspaperF71": 2,
+        "recycleMagsF73": 2,
+    }
+    columns = {}
+    for name, (_, default) in EPAGHGCalculator.input_labels_defaults.items():
+        if name in codes:
+            columns[name] = rng.integers(1, codes[name] + 1, n).astype(np.float64)
+        elif name == "greenPowerPercentF49":
+            columns[name] = rng.uniform(0, 100, n)
+        elif name == "foodPreferences_vegan2MeatScale":
+            columns[name] = rng.uniform(0, 1, n)
+        else:
+            columns[name] = rng.uniform(0, 3 * max(default, 1), n)
+    return columns
+
+
+def test_calculate_batch_bit_for_bit():
+    # Equality holds for float64 inputs; float32 scalars would be computed in
+    # float32 by calculate(), whereas calculate_batch converts them to float64
+    n = 200
+    columns = random_input_columns(n)
+    batch = co2_calculator.calculate_batch(columns)
+    scalar = np.array([co2_calculator.calculate({name: values[i] for name, values in columns.items()})
+                       for i in range(n)])
+    assert batch.dtype == np.float64
+    np.testing.assert_array_equal(batch, scalar)
+
+
+def test_emission_factors():
+    calculator = EPAGHGCalculator(EPAGHGCalculatorConfig(emission_factors={"e_factor_value": 1.0}))
+    assert calculator.e_factor_value == 1.0
+
+    # Inputs, cells and other attributes are not emission factors
+    for name in ["vehicle1MilesD15", "J26", "J26_batch", "calculate", "flights_average_km_and_costs", "unknown"]:
+        with pytest.raises(ValueError):
+            EPAGHGCalculator(EPAGHGCalculatorConfig(emission_factors={name: 1.0}))
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from input_pipeline import windows_dataset
+from preprocessing import WindowDataset
+
+
+def window_dataset(agents=3, days=140):
+    series = np.random.default_rng(0).random((agents * days, 16), dtype=np.float32)
+    starts = np.concatenate([agent * days + np.arange(days - 127) for agent in range(agents)])
+    index = np.stack([starts // days, starts], axis=1)
+    return WindowDataset(series, index)
+
+
+def batches(dataset):
+    return np.concatenate([batch.numpy() for batch in dataset])
+
+
+@pytest.mark.parametrize("array", [False, True])
+def test_unshuffled_order(array):
+    source = window_dataset()
+    windows = np.asarray(source)
+    dataset = windows_dataset(windows if array else source, batch_size=8, shuffle=False, cache=True)
+
+    # Every epoch yields the windows in the order of the source
+    for epoch in range(2):
+        np.testing.assert_array_equal(batches(dataset), windows)
+
+
+def test_shuffled_epochs():
+    source = window_dataset()
+    windows = np.asarray(source)
+    dataset = windows_dataset(source, batch_size=8, seed=0)
+
+    first, second = batches(dataset), batches(dataset)
+    assert first.shape == windows.shape
+    assert not np.array_equal(first, windows)
+    assert not np.array_equal(first, second)
+
+    # Each epoch yields every window once
+    key = lambda w: w[:, 0, 0]
+    np.testing.assert_array_equal(np.sort(key(first)), np.sort(key(windows)))
+    np.testing.assert_array_equal(np.sort(key(second)), np.sort(key(windows)))
+
+
+def test_cached_shuffled():
+    with pytest.raises(ValueError):
+        windows_dataset(window_dataset(), shuffle=True, cache=True)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from tensorflow import keras
+
+from latent_cache import LatentCache, dataset_hash, model_hash
+from preprocessing import WindowDataset
+
+
+def window_dataset(seed=0, agents=2, days=140):
+    series = np.random.default_rng(seed).random((agents * days, 16), dtype=np.float32)
+    starts = np.concatenate([agent * days + np.arange(days - 127) for agent in range(agents)])
+    return WindowDataset(series, np.stack([starts // days, starts], axis=1))
+
+
+def save_encoder(path, seed):
+    keras.utils.set_random_seed(seed)
+    inputs = keras.Input(shape=(128, 16))
+    x = keras.layers.Flatten()(inputs)
+    outputs = [keras.layers.Dense(2)(x) for _ in range(3)]
+    encoder = keras.Model(inputs, outputs)
+    encoder.save(path)
+    return encoder
+
+
+def test_embeddings(tmp_path, monkeypatch):
+    encoder_path = str(tmp_path / "encoder.keras")
+    encoder = save_encoder(encoder_path, seed=0)
+    dataset = window_dataset()
+    cache = LatentCache(str(tmp_path / "cache"))
+
+    embeddings = cache.embeddings(encoder_path, dataset)
+    z_mean, z_log_var, _ = encoder.predict(np.asarray(dataset), verbose=0)
+    np.testing.assert_allclose(embeddings.z_mean, z_mean, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(embeddings.z_log_var, z_log_var, rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(embeddings.index, dataset.index)
+
+    # The same encoder and dataset are not encoded again
+    def load_model(*args, **kwargs):
+        raise AssertionError("load_model: called for cached embeddings")
+    monkeypatch.setattr(keras.models, "load_model", load_model)
+    cached = cache.embeddings(encoder_path, window_dataset())
+    np.testing.assert_array_equal(cached.z_mean, embeddings.z_mean)
+
+    # A retrained encoder or a rebuilt dataset is
+    with pytest.raises(AssertionError, match="cached"):
+        cache.embeddings(encoder_path, window_dataset(seed=1))
+    save_encoder(encoder_path, seed=1)
+    with pytest.raises(AssertionError, match="cached"):
+        cache.embeddings(encoder_path, dataset)
+
+
+def test_keys(tmp_path):
+    dataset = window_dataset()
+    assert dataset_hash(dataset) == dataset_hash(window_dataset())
+    assert dataset_hash(dataset) != dataset_hash(window_dataset(seed=1))
+    assert dataset_hash(dataset) != dataset_hash(dataset.subsample(0.5, seed=0))
+    assert dataset_hash(dataset) == dataset_hash(dataset, chunk_size=7)
+
+    # SavedModel directories are hashed file by file
+    directory = tmp_path / "encoder"
+    (directory / "variables").mkdir(parents=True)
+    (directory / "saved_model.pb").write_bytes(b"graph")
+    (directory / "variables" / "variables.index").write_bytes(b"weights")
+    key = model_hash(str(directory))
+    (directory / "variables" / "variables.index").write_bytes(b"retrained weights")
+    assert model_hash(str(directory)) != key
@@ -0,0 +1,39 @@
+import numpy as np
+from scipy.stats import norm
+from tensorflow import keras
+
+from latent_sampling import decode, decode_all, grid, prior
+
+
+def test_grid_order():
+    n = 5
+    grid_x = norm.ppf(np.linspace(0.01, 0.99, n))
+    grid_y = norm.ppf(np.linspace(0.01, 0.99, n))
+    expected = [[xi, yi] for i, yi in enumerate(grid_y) for j, xi in enumerate(grid_x)]
+    np.testing.assert_array_equal(grid(n), expected)
+    assert grid(3, latent_dim=3).shape == (27, 3)
+
+
+def test_prior():
+    chunks = list(prior(20000, chunk_size=8192, seed=0))
+    assert [len(chunk) for chunk in chunks] == [8192, 8192, 3616]
+    assert all(chunk.shape[1] == 2 and chunk.dtype == np.float32 for chunk in chunks)
+    np.testing.assert_array_equal(np.concatenate(chunks), np.concatenate(list(prior(20000, seed=0))))
+
+
+def test_decode_matches_predict():
+    keras.utils.set_random_seed(0)
+    latent_inputs = keras.Input(shape=(2,))
+    x = keras.layers.Dense(2048, activation="relu")(latent_inputs)
+    x = keras.layers.Reshape((128, 16))(x)
+    outputs = keras.layers.Conv1DTranspose(16, 3, activation="sigmoid", padding="same")(x)
+    decoder = keras.Model(latent_inputs, outputs)
+
+    # The samples of the per-point predict calls that decode replaced
+    z = grid(4)
+    expected = np.stack([decoder.predict(np.array([point]), verbose=0)[0] for point in z])
+
+    np.testing.assert_allclose(decode_all(decoder, z, chunk_size=5), expected, atol=1e-6)
+    chunks = list(decode(decoder, [z[:3], z[3:]]))
+    assert [len(chunk) for chunk in chunks] == [3, 13]
+    np.testing.assert_allclose(np.concatenate(chunks), expected, atol=1e-6)
@@ -0,0 +1,21 @@
+import numpy as np
+
+from losses import compiled_vae_loss, step_loss, vae_loss
+
+
+def test_step_loss():
+    # A step compiled with XLA must not nest another XLA-compiled function
+    assert step_loss(True) is vae_loss
+    assert step_loss(False) is compiled_vae_loss
+
+
+def test_compiled_vae_loss():
+    rng = np.random.default_rng(0)
+    data = rng.random((4, 128, 16), dtype=np.float32)
+    reconstruction = rng.uniform(0.01, 0.99, (4, 128, 16)).astype(np.float32)
+    z_mean, z_log_var = rng.standard_normal((2, 4, 2), dtype=np.float32)
+
+    expected = vae_loss(data, reconstruction, z_mean, z_log_var)
+    losses = compiled_vae_loss(data, reconstruction, z_mean, z_log_var)
+    for name, loss in expected.items():
+        np.testing.assert_allclose(losses[name], loss, rtol=1e-5)
@@ -0,0 +1,61 @@
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from parallel_search import available_cores, launch
+
+package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_conflicting_threads():
+    with pytest.raises(ValueError):
+        launch(2, 2, environ={"TF_NUM_INTRAOP_THREADS": "4", "OMP_NUM_THREADS": "4"})
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="no CPU affinity")
+def test_workers_pinned_at_start(tmp_path):
+    # The script records the cores it runs on before doing anything else
+    script = tmp_path / "script.py"
+    script.write_text(textwrap.dedent("""
+        import os, sys
+        with open(os.path.join(sys.argv[1], os.environ["KERASTUNER_TUNER_ID"]), "w") as f:
+            f.write(" ".join(map(str, sorted(os.sched_getaffinity(0)))))
+    """))
+    assert launch(2, 1, script=str(script), script_args=[str(tmp_path)]) == [0, 0, 0]
+
+    cores = available_cores()
+    assert (tmp_path / "tuner0").read_text() == str(cores[0])
+    assert (tmp_path / "tuner1").read_text() == str(cores[1 % len(cores)])
+
+
+def test_sigterm_terminates_workers(tmp_path):
+    # The workers write their pid and sleep; the launcher is terminated once they run
+    script = tmp_path / "script.py"
+    script.write_text(textwrap.dedent("""
+        import os, sys, time
+        with open(os.path.join(sys.argv[1], str(os.getpid())), "w") as f:
+            f.write("")
+        time.sleep(60)
+    """))
+    launcher = subprocess.Popen([sys.executable, "-c", textwrap.dedent("""
+        import sys
+        from parallel_search import launch
+        launch(2, 1, script=sys.argv[1], script_args=[sys.argv[2]])
+    """), str(script), str(tmp_path)], cwd=package)
+
+    deadline = time.monotonic() + 30
+    while len(list(tmp_path.glob("[0-9]*"))) < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    pids = [int(path.name) for path in tmp_path.glob("[0-9]*")]
+    assert len(pids) == 3
+
+    launcher.send_signal(signal.SIGTERM)
+    assert launcher.wait(30) == 128 + signal.SIGTERM
+    for pid in pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
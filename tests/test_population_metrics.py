@@ -0,0 +1,29 @@
+import numpy as np
+from scipy.stats import ks_2samp, wasserstein_distance
+
+from population_metrics import compare, ks_wasserstein
+
+
+def test_ks_wasserstein():
+    rng = np.random.default_rng(0)
+    a = rng.random((500, 3))
+    b = rng.random((700, 3)) ** 2
+    ks, wasserstein = ks_wasserstein(a, b)
+    for f in range(3):
+        assert np.isclose(ks[f], ks_2samp(a[:, f], b[:, f]).statistic)
+        assert np.isclose(wasserstein[f], wasserstein_distance(a[:, f], b[:, f]))
+
+
+def test_compare_sampling():
+    rng = np.random.default_rng(0)
+    windows = rng.random((100, 128, 16), dtype=np.float32)
+
+    report = compare(windows, windows, max_windows=None, max_values=None)
+    assert not report["sampled"]
+    assert report["mean_ks"] == 0
+    assert report["correlation_distance"] == 0
+
+    report = compare(windows, windows, max_windows=50, max_values=1000)
+    assert report["sampled"]
+    assert report["evaluated_windows"] == [50, 50]
+    assert report["distribution_values"] == [1000, 1000]
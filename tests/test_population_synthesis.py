@@ -0,0 +1,30 @@
+import threading
+import time
+
+import numpy as np
+
+from population_synthesis import synthesize
+
+
+def decoder(z):
+    return np.full((len(z), 128, 16), 0.25, dtype=np.float32)
+
+
+def test_synthesize():
+    z = np.random.default_rng(0).standard_normal((100, 2))
+    chunks = sorted(synthesize(decoder, z, [30000., 12., 8., 4.], chunk_size=16), key=lambda chunk: chunk.start)
+    assert [chunk.start for chunk in chunks] == list(range(0, 100, 16))
+    assert sum(len(chunk.footprints) for chunk in chunks) == 100
+
+
+def test_closed_generator_stops_threads():
+    before = set(threading.enumerate())
+    z = np.random.default_rng(0).standard_normal((10000, 2))
+    population = synthesize(decoder, z, [30000., 12., 8., 4.], chunk_size=16, workers=3)
+    next(population)
+    population.close()
+
+    deadline = time.monotonic() + 10
+    while set(threading.enumerate()) - before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not set(threading.enumerate()) - before
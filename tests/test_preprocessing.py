@@ -0,0 +1,136 @@
+import datetime
+import os
+
+import bson
+import numpy as np
+import pandas as pd
+import pytest
+
+import preprocessing
+from preprocessing import (WindowDataset, build_dataset, build_series, build_vec, extract_columns, feature_columns,
+                           load_agent_states, load_dataset, preprocess, read_columns)
+
+
+def agent_state(agent_state_id, diet=0.5):
+    return {
+        'agentStateId': agent_state_id,
+        'simulationTime': datetime.datetime(2020, 1, 1),
+        'variables': {
+            'recyclingSelection': {'plastic': True, 'glass': False, 'magazines': True, 'newspapers': False,
+                                   'aluminumAndSteel': True},
+            'mobility': {'car': {'annualKilometersByCar': 12000},
+                         'airplane': [{'numberTrips': 1}, {'numberTrips': 2}, {'numberTrips': 0}]},
+            'votings': [{'value': 'lower'}],
+            'foodPreferences': {'vegan2MeatScale': diet},
+        },
+    }
+
+
+def test_extract_columns():
+    states = [agent_state(1), agent_state(2, diet=0.25)]
+    aids, _, features = extract_columns(states)
+    np.testing.assert_array_equal(aids, [1, 2])
+    np.testing.assert_array_equal(features, [build_vec(s)[2:] for s in states])
+
+
+def test_extract_columns_missing_value():
+    with pytest.raises(ValueError, match="agent state 2"):
+        extract_columns([agent_state(1), agent_state(2, diet=None)])
+
+
+def test_extract_columns_nan():
+    # build_vec passes NaN values through; extract_columns rejects them
+    state = agent_state(3, diet=float("nan"))
+    assert np.isnan(build_vec(state)[-1])
+    with pytest.raises(ValueError, match="agent state 3"):
+        extract_columns([agent_state(1), state])
+
+
+def normalized_agents(lengths, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.concat([
+        pd.DataFrame(rng.random((length, 16)), columns=feature_columns + ["pad0", "pad1"]).assign(aid=aid)
+        for aid, length in enumerate(lengths)
+    ], ignore_index=True)[["aid"] + feature_columns + ["pad0", "pad1"]]
+
+
+def test_window_dataset_matches_sliding_windows():
+    df_normalized = normalized_agents([130, 128, 140])
+    series, index = build_series(df_normalized)
+
+    # The windows that preparation.org used to build and pickle
+    window_list = []
+    for aid, data in df_normalized.groupby('aid'):
+        aid_np = data.reset_index(drop=True).drop('aid', axis=1).to_numpy().astype('float32')
+        window_list.append(np.lib.stride_tricks.sliding_window_view(aid_np, (128, 16))[:, 0, :, :])
+    expected = np.vstack(window_list)
+
+    dataset = WindowDataset(series, index)
+    assert dataset.shape == expected.shape
+    np.testing.assert_array_equal(np.asarray(dataset), expected)
+    np.testing.assert_array_equal(index[:, 0], np.repeat([0, 1, 2], [3, 1, 13]))
+    np.testing.assert_array_equal(dataset[[16, 2]], expected[[16, 2]])
+    np.testing.assert_array_equal(np.concatenate(list(dataset.batches(5))), expected)
+
+
+@pytest.fixture
+def dumps(tmp_path, monkeypatch):
+    """Two small dumps of daily agent states, with dataset_root pointing to them"""
+    monkeypatch.setattr(preprocessing, "dataset_root", str(tmp_path))
+    start = datetime.datetime(2020, 1, 1)
+    for dump, aids in (("dump0", [1, 2, 3]), ("dump1", [4, 5])):
+        os.makedirs(tmp_path / dump)
+        with open(tmp_path / dump / "agent_variables_state.bson", "wb") as f:
+            for day in range(140):
+                for aid in aids:
+                    # Distinct simulation times, as duplicates are dropped across the dump
+                    state = agent_state(aid, diet=(day % 7) / 7)
+                    state['simulationTime'] = start + datetime.timedelta(days=day, minutes=aid)
+                    f.write(bson.encode(state))
+    return [("dump0", [1, 3]), ("dump1", [4, 5])]
+
+
+def test_build_dataset_cache(dumps, tmp_path, monkeypatch):
+    cache_directory = str(tmp_path / "cache")
+    series, index, mobility_max = build_dataset(dumps, cache_directory=cache_directory, processes=1)
+    # Each resampled day holds the last state before midnight, so the first day is dropped
+    assert len(series) == 4 * 139
+    assert sorted(set(index[:, 0])) == [1, 3, 4, 5]
+
+    # A rebuild reads every stage from the cache instead of decoding the dumps again
+    def preprocess_dumps(dumps, processes=None):
+        raise AssertionError("preprocess_dumps: called on a rebuild")
+    monkeypatch.setattr(preprocessing, "preprocess_dumps", preprocess_dumps)
+    cached_series, cached_index, cached_mobility_max = build_dataset(dumps, cache_directory=cache_directory)
+    np.testing.assert_array_equal(cached_series, series)
+    np.testing.assert_array_equal(cached_index, index)
+    assert cached_mobility_max == mobility_max
+
+    # A new agent selection of a dump is not a cache hit
+    with pytest.raises(AssertionError, match="rebuild"):
+        build_dataset([("dump0", [1, 2]), dumps[1]], cache_directory=cache_directory)
+
+
+def test_preprocess_matches_load_dataset(dumps):
+    expected = pd.concat([load_dataset(path, agents) for path, agents in dumps], ignore_index=True)
+    pd.testing.assert_frame_equal(preprocess(dumps, processes=2), expected)
+
+
+def test_read_columns_grows():
+    states = [agent_state(aid, diet=aid / 10) for aid in range(10)]
+    aids, simulation_times, features = read_columns(iter(states), capacity=4, chunk_size=3)
+    np.testing.assert_array_equal(aids, np.arange(10))
+    np.testing.assert_array_equal(features, [build_vec(s)[2:] for s in states])
+
+
+def test_load_agent_states_matches_decode_all(dumps, tmp_path):
+    path, agents = dumps[0]
+    agent_states_df = load_agent_states(path, agents)
+
+    # The dataframe that load_dataset used to build from the decoded dump
+    with open(tmp_path / path / "agent_variables_state.bson", "rb") as f:
+        agent_states = [s for s in bson.decode_all(f.read()) if s['agentStateId'] in agents]
+    expected = pd.DataFrame([build_vec(s) for s in agent_states], columns=['aid', 'simulation_time'] + feature_columns)
+    expected['simulation_time'] = expected['simulation_time'].astype('datetime64[ms]')
+
+    pd.testing.assert_frame_equal(agent_states_df.reset_index(drop=True), expected)
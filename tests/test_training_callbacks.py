@@ -0,0 +1,99 @@
+import csv
+import json
+import logging
+
+import numpy as np
+import pytest
+import tensorflow as tf
+from tensorflow import keras
+
+from training_callbacks import DivergenceGuard, ThroughputLogger
+
+
+class Diverging(keras.Model):
+    """Reports the loss of its one weight, which turns NaN after a few steps"""
+
+    def __init__(self, diverge_at):
+        super(Diverging, self).__init__()
+        self.diverge_at = diverge_at
+        self.dense = keras.layers.Dense(1)
+
+    def call(self, inputs):
+        return self.dense(inputs)
+
+    def train_step(self, data):
+        step = self.optimizer.iterations
+        self.optimizer.iterations.assign_add(1)
+        loss = keras.ops.where(step >= self.diverge_at, np.nan, 1.)
+        return {"loss": loss, "kl_loss": keras.ops.zeros(())}
+
+
+def fit(model, guard, batches=20, epochs=3):
+    model.compile(optimizer="sgd")
+    model.fit(np.ones((batches, 2)), batch_size=1, epochs=epochs, callbacks=[guard], verbose=0)
+
+
+def test_stops_and_logs(caplog):
+    model = Diverging(diverge_at=12)
+    guard = DivergenceGuard(check_every=5)
+    with caplog.at_level(logging.WARNING):
+        fit(model, guard)
+    assert guard.diverged
+    # Stopped at the first check after the loss turned NaN
+    assert int(model.optimizer.iterations) == 15
+    assert "diverged at batch 14" in caplog.text
+
+
+def test_raises_error():
+    with pytest.raises(RuntimeError, match="diverged at epoch 0"):
+        fit(Diverging(diverge_at=0), DivergenceGuard(error=RuntimeError, check_every=100))
+
+
+def test_finished_run():
+    guard = DivergenceGuard(check_every=5)
+    fit(Diverging(diverge_at=10 ** 6), guard)
+    assert not guard.diverged
+
+
+def linear_model():
+    model = keras.Sequential([keras.Input(shape=(2,)), keras.layers.Dense(1)])
+    model.compile(optimizer="sgd", loss="mse")
+    return model
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_throughput_logger(tmp_path):
+    filename = str(tmp_path / "throughput.csv")
+    logger = ThroughputLogger(filename, batch_size=4)
+    data = tf.data.Dataset.from_tensor_slices((np.ones((40, 2)), np.ones(40))).batch(4)
+    linear_model().fit(logger.instrument(data), epochs=2, callbacks=[logger], verbose=0)
+
+    rows = read_rows(filename)
+    assert [int(row["steps"]) for row in rows] == [10, 10]
+    for row in rows:
+        assert float(row["steps_per_sec"]) > 0
+        assert float(row["samples_per_sec"]) == pytest.approx(4 * float(row["steps_per_sec"]))
+        assert float(row["input_wait_time"]) + float(row["compute_time"]) <= float(row["epoch_time"])
+
+    with open(str(tmp_path / "throughput.json")) as f:
+        report = json.load(f)
+    assert report["batch_size"] == 4 and len(report["epochs"]) == 2
+
+    # A new run overwrites the CSV file, unless it resumes the previous one
+    linear_model().fit(np.ones((8, 2)), np.ones(8), batch_size=4, epochs=1,
+                       callbacks=[ThroughputLogger(filename, batch_size=4)], verbose=0)
+    assert len(read_rows(filename)) == 1
+    linear_model().fit(np.ones((8, 2)), np.ones(8), batch_size=4, epochs=1,
+                       callbacks=[ThroughputLogger(filename, batch_size=4, append=True)], verbose=0)
+    assert len(read_rows(filename)) == 2
+
+
+def test_instrument_windows(tmp_path):
+    logger = ThroughputLogger(str(tmp_path / "throughput.csv"))
+    windows = logger.instrument(tf.data.Dataset.from_tensor_slices(np.ones((8, 128, 16), np.float32)).batch(4))
+    assert [batch.shape for batch in windows] == [(4, 128, 16)] * 2
+    assert logger._available is not None
@@ -0,0 +1,178 @@
+"""
+Keras callbacks recording the training throughput of the VAE and stopping diverging runs
+
+ThroughputLogger complements CSVLogger('training.log'), which records the
+losses, with the speed of training, so that slowdowns show up in the same way
+as regressions in the loss.
+"""
+import csv
+import json
+import logging
+import math
+import os
+import time
+
+import tensorflow as tf
+from tensorflow import keras
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss():
+    """Peak resident set size of the process in MB, None where it is unknown"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ThroughputLogger(keras.callbacks.Callback):
+    """Records steps/sec, samples/sec, epoch time, input wait and peak RSS of each epoch
+
+    The rows are appended to a CSV file after each epoch, and all epochs are
+    written to a JSON file of the same name at the end of training. Unless
+    append is set, e.g. when resuming a run, the CSV file is overwritten.
+
+    The time spent waiting for the input pipeline is only known for datasets
+    passed through instrument; otherwise the whole step counts as compute.
+    profile_batches=(start, stop) captures a tf.profiler trace of these
+    training steps (counted across epochs) into profile_dir.
+    """
+    def __init__(self, filename="throughput.csv", batch_size=64, profile_batches=None, profile_dir="profile",
+                 append=False):
+        super(ThroughputLogger, self).__init__()
+        self.filename = filename
+        self.batch_size = batch_size
+        self.profile_batches = profile_batches
+        self.profile_dir = profile_dir
+        self.append = append
+        self.epochs = []
+        self._step = 0
+        self._instrumented = False
+        self._available = None
+
+    def instrument(self, dataset):
+        """Returns the dataset, recording when each batch leaves the pipeline"""
+        self._instrumented = True
+
+        # Batches are windows, or tuples such as (inputs, targets)
+        def record(*batch):
+            available = tf.py_function(self._record_available, [], tf.float64)
+            with tf.control_dependencies([available]):
+                batch = tf.nest.map_structure(tf.identity, batch)
+            return batch if len(batch) > 1 else batch[0]
+
+        return dataset.map(record)
+
+    def _record_available(self):
+        self._available = time.perf_counter()
+        return self._available
+
+    def on_train_begin(self, logs=None):
+        self.epochs = []
+        if not self.append and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._first_step = None
+        self._steps = 0
+        self._input_wait = 0.
+        self._compute = 0.
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.profile_batches and self._step == self.profile_batches[0]:
+            tf.profiler.experimental.start(self.profile_dir)
+
+        self._available = None
+        self._step_start = time.perf_counter()
+        if self._first_step is None:
+            self._first_step = self._step_start
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._last_step = time.perf_counter()
+        step_time = self._last_step - self._step_start
+        if self._instrumented and self._available is not None:
+            input_wait = min(max(self._available - self._step_start, 0.), step_time)
+        else:
+            input_wait = 0.
+        self._input_wait += input_wait
+        self._compute += step_time - input_wait
+        self._steps += 1
+
+        if self.profile_batches and self._step == self.profile_batches[1]:
+            tf.profiler.experimental.stop()
+        self._step += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        # Steps/sec and samples/sec only count the training steps, not validation
+        train_time = self._last_step - self._first_step if self._steps else 0.
+        row = {
+            "epoch": epoch,
+            "steps": self._steps,
+            "steps_per_sec": self._steps / train_time if train_time else 0.,
+            "samples_per_sec": self._steps * self.batch_size / train_time if train_time else 0.,
+            "epoch_time": time.perf_counter() - self._epoch_start,
+            "input_wait_time": self._input_wait,
+            "compute_time": self._compute,
+            "peak_rss_mb": peak_rss(),
+        }
+        self.epochs.append(row)
+
+        new_file = not os.path.exists(self.filename)
+        with open(self.filename, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def on_train_end(self, logs=None):
+        # Stops a trace that is still running when training ends early
+        if self.profile_batches and self.profile_batches[0] <= self._step - 1 < self.profile_batches[1]:
+            tf.profiler.experimental.stop()
+
+        with open(os.path.splitext(self.filename)[0] + ".json", "w") as f:
+            json.dump({"batch_size": self.batch_size, "epochs": self.epochs}, f, indent=2)
+
+
+class DivergenceGuard(keras.callbacks.Callback):
+    """Stops training when the loss is NaN or infinite, or the KL loss exceeds max_kl_loss
+
+    The losses are checked every check_every batches, which saves reading them
+    back on every step, and at the end of every epoch. If error is given, e.g.
+    keras_tuner.errors.FailedTrialError, it is raised instead, so that the
+    caller can tell the diverged run from a finished one.
+    """
+    def __init__(self, max_kl_loss=1e4, error=None, check_every=50):
+        super(DivergenceGuard, self).__init__()
+        self.max_kl_loss = max_kl_loss
+        self.error = error
+        self.check_every = check_every
+        self.diverged = False
+
+    def on_train_begin(self, logs=None):
+        self.diverged = False
+
+    def check(self, where, logs):
+        logs = logs or {}
+        loss = float(logs.get("loss", 0.))
+        kl_loss = float(logs.get("kl_loss", 0.))
+        if math.isfinite(loss) and math.isfinite(kl_loss) and kl_loss <= self.max_kl_loss:
+            return
+
+        self.diverged = True
+        message = "DivergenceGuard: diverged at {}, loss {}, kl_loss {}".format(where, loss, kl_loss)
+        if self.error is not None:
+            raise self.error(message)
+        logging.warning(message)
+        self.model.stop_training = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        if (batch + 1) % self.check_every == 0:
+            self.check("batch {}".format(batch), logs)
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not self.diverged:
+            self.check("epoch {}".format(epoch), logs)
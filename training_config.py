@@ -0,0 +1,110 @@
+"""
+CPU training settings of the VAE: mixed precision, oneDNN, threads and XLA
+
+TensorFlow reads the oneDNN and thread settings when it is loaded and when its
+runtime starts, so they are passed to new processes through their environment
+(see environ), while apply configures the current process as far as it still
+can. benchmark_training.py measures the steps/sec of each setting.
+"""
+import argparse
+import dataclasses
+import logging
+import os
+import sys
+from dataclasses import dataclass
+from typing import Optional
+
+
+precisions = ["auto", "float32", "mixed_bfloat16"]
+"""Keras dtype policies of the model; auto uses mixed_bfloat16 where the CPU supports it"""
+
+
+def bfloat16_supported():
+    """Whether the CPU has native bfloat16 instructions (AVX512_BF16 or AMX)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    return bool(flags & {"avx512_bf16", "amx_bf16"})
+
+
+@dataclass(frozen=True)
+class TrainingConfig:
+    """Settings of a training process
+
+    onednn None and thread counts of 0 keep the TensorFlow defaults. The loss
+    and the Sampling layer always compute in float32, whatever the precision.
+    """
+    precision: str = "float32"
+    onednn: Optional[bool] = None
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    jit_compile: bool = False
+
+    def __post_init__(self):
+        if self.precision not in precisions:
+            raise ValueError("TrainingConfig: unknown precision {}".format(self.precision))
+
+    def policy(self):
+        """Name of the Keras dtype policy"""
+        if self.precision == "auto":
+            return "mixed_bfloat16" if bfloat16_supported() else "float32"
+        return self.precision
+
+    def environ(self):
+        """Environment variables to set before TensorFlow is loaded"""
+        env = {}
+        if self.onednn is not None:
+            env["TF_ENABLE_ONEDNN_OPTS"] = "1" if self.onednn else "0"
+        if self.intra_op_threads:
+            env["TF_NUM_INTRAOP_THREADS"] = str(self.intra_op_threads)
+            env["OMP_NUM_THREADS"] = str(self.intra_op_threads)
+        if self.inter_op_threads:
+            env["TF_NUM_INTEROP_THREADS"] = str(self.inter_op_threads)
+        return env
+
+    def apply(self):
+        """Configures TensorFlow in the current process and returns the dtype policy
+
+        Must be called before the models are built.
+        """
+        env = self.environ()
+        if ("tensorflow" in sys.modules
+                and "TF_ENABLE_ONEDNN_OPTS" in env
+                and os.environ.get("TF_ENABLE_ONEDNN_OPTS") != env["TF_ENABLE_ONEDNN_OPTS"]):
+            logging.warning("TrainingConfig: TensorFlow is already loaded, set TF_ENABLE_ONEDNN_OPTS=%s "
+                            "in the environment of the process instead", env["TF_ENABLE_ONEDNN_OPTS"])
+        os.environ.update(env)
+
+        import tensorflow as tf
+        from tensorflow import keras
+
+        try:
+            if self.intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(self.intra_op_threads)
+            if self.inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        except RuntimeError:
+            logging.warning("TrainingConfig: TensorFlow runtime already started, thread counts not changed")
+
+        policy = self.policy()
+        keras.mixed_precision.set_global_policy(policy)
+        return policy
+
+
+def add_arguments(parser):
+    """Adds the TrainingConfig options to an argparse parser"""
+    group = parser.add_argument_group("training")
+    group.add_argument("--precision", choices=precisions, default="float32")
+    group.add_argument("--onednn", action=argparse.BooleanOptionalAction, default=None,
+                       help="enable or disable (--no-onednn) the oneDNN optimizations")
+    group.add_argument("--intra-op-threads", type=int, default=0)
+    group.add_argument("--inter-op-threads", type=int, default=0)
+    group.add_argument("--jit-compile", action="store_true", help="compile train_step with XLA")
+
+
+def from_args(args):
+    """TrainingConfig of the options parsed by a parser with add_arguments"""
+    return TrainingConfig(**{field.name: getattr(args, field.name)
+                             for field in dataclasses.fields(TrainingConfig)})
@@ -1,16 +1,23 @@
+import argparse
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
 import kerastuner as kt
-import pickle
+from preprocessing import WindowDataset
+from input_pipeline import windows_dataset
+from losses import step_loss
+from training_config import TrainingConfig, add_arguments, from_args
+from training_callbacks import DivergenceGuard
 
-# Loads dataset
-dataset_train = pickle.load(open("dataset_train.p", "rb"))
-dataset_test = pickle.load(open("dataset_test.p", "rb"))
+training_config = TrainingConfig()
+"""Training settings of the models built by model_builder, set by main"""
 
 class Sampling(layers.Layer):
-    """Sampling layer that samples from latent space"""
+    """Sampling layer that samples from latent space
+
+    Built with dtype="float32", so that it samples in full precision under a mixed precision policy.
+    """
     def call(self, inputs):
         z_mean, z_log_var = inputs
         batch = tf.shape(z_mean)[0]
@@ -57,62 +64,29 @@ class VAE(keras.Model):
             self.f_loss_trackers["co2"]
         ]
 
+    def call(self, inputs):
+        """Reconstructs the windows"""
+        z_mean, z_log_var, z = self.encoder(inputs)
+        return self.decoder(z)
+
     def train_step(self, data):
         """Defines the training step"""
-
         with tf.GradientTape() as tape:
             z_mean, z_log_var, z = self.encoder(data)
             reconstruction = self.decoder(z)
+            losses = step_loss(self.jit_compile)(data, reconstruction, z_mean, z_log_var, self.beta)
 
-            # Binary cross-entropy loss for recycling preferences
-            recycling_loss = tf.reduce_mean(
-                 keras.losses.binary_crossentropy(
-                    data[:,:,0:5],
-                    reconstruction[:,:,0:5]
-                    ),
-                    axis = 1
-            )
-
-            # MSE loss for mobility
-            mobility_loss = tf.reduce_mean(
-                    keras.losses.mean_squared_error(data[:,:,5:9], reconstruction[:,:,5:9]),
-		axis = 1
-	    )
-
-            # Categorical cross-entropy loss for Co2 votes
-            co2_loss = tf.reduce_mean(
-                    keras.losses.categorical_crossentropy(
-                    data[:,:,9:13],
-                    reconstruction[:,:,9:13]
-                    ),
-                    axis = 1
-		) 
-
-            # MSE loss for diet preferences
-            mse = keras.losses.mean_squared_error(data[:,:,13], reconstruction[:,:,13])
-            diet_loss = tf.reduce_mean(
-                    tf.reduce_sum(
-                    mse
-                    )
-	    )
-
-            reconstruction_loss = recycling_loss + diet_loss + mobility_loss + co2_loss
-
-            kl_loss = -0.5 * (1 + z_log_var - tf.square(z_mean) - tf.exp(z_log_var))
-            kl_loss = self.beta * tf.reduce_mean(tf.reduce_sum(kl_loss, axis=1))
-            total_loss = reconstruction_loss + kl_loss
-
-        grads = tape.gradient(total_loss, self.trainable_weights)
+        grads = tape.gradient(losses["total"], self.trainable_weights)
         self.optimizer.apply_gradients(zip(grads, self.trainable_weights))
-        self.total_loss_tracker.update_state(total_loss)
-        self.reconstruction_loss_tracker.update_state(reconstruction_loss)
-        self.kl_loss_tracker.update_state(kl_loss)
+        self.total_loss_tracker.update_state(losses["total"])
+        self.reconstruction_loss_tracker.update_state(losses["reconstruction"])
+        self.kl_loss_tracker.update_state(losses["kl"])
 
         # Updates loss trackers for feature categories
-        self.f_loss_trackers["recycling"].update_state(recycling_loss)
-        self.f_loss_trackers["mobility"].update_state(mobility_loss)
-        self.f_loss_trackers["diet"].update_state(diet_loss)
-        self.f_loss_trackers["co2"].update_state(diet_loss)
+        self.f_loss_trackers["recycling"].update_state(losses["recycling"])
+        self.f_loss_trackers["mobility"].update_state(losses["mobility"])
+        self.f_loss_trackers["diet"].update_state(losses["diet"])
+        self.f_loss_trackers["co2"].update_state(losses["co2"])
 
         return {
             "loss": self.total_loss_tracker.result(),
@@ -132,43 +106,10 @@ class VAE(keras.Model):
 
         z_mean, z_log_var, z = self.encoder(data)
         reconstruction = self.decoder(z)
+        losses = step_loss(self.jit_compile)(data, reconstruction, z_mean, z_log_var, self.beta)
 
-        # Binary cross-entropy loss for recycling preferences
-        recycling_loss = tf.reduce_mean(
-             keras.losses.binary_crossentropy(
-                data[:,:,0:5],
-                reconstruction[:,:,0:5]
-                ),
-                axis = 1
-        )
-
-        # MSE loss for mobility
-        mobility_loss = tf.reduce_mean(
-                keras.losses.mean_squared_error(data[:,:,5:9], reconstruction[:,:,5:9]),
-	axis = 1
-	)
-
-        # Categorical cross-entropy loss for Co2 votes
-        co2_loss = tf.reduce_mean(
-                keras.losses.categorical_crossentropy(
-                data[:,:,9:13],
-                reconstruction[:,:,9:13]
-                ),
-                axis = 1
-	) 
-
-        # MSE loss for diet preferences
-        mse = keras.losses.mean_squared_error(data[:,:,13], reconstruction[:,:,13])
-        diet_loss = tf.reduce_mean(
-                tf.reduce_sum(
-                mse
-                )
-	)
-
-        reconstruction_loss = tf.reduce_mean(recycling_loss + diet_loss + mobility_loss + co2_loss)
-
-        kl_loss = -0.5 * (1 + z_log_var - tf.square(z_mean) - tf.exp(z_log_var))
-        kl_loss = self.beta * tf.reduce_mean(tf.reduce_sum(kl_loss, axis=1))
+        reconstruction_loss = tf.reduce_mean(losses["reconstruction"])
+        kl_loss = losses["kl"]
         total_loss = reconstruction_loss + kl_loss
 
         return {
@@ -197,7 +138,7 @@ def model_builder(hp):
     x = layers.Flatten()(x)
     z_mean = layers.Dense(latent_dim, name="z_mean")(x)
     z_log_var = layers.Dense(latent_dim, name="z_log_var")(x)
-    z = Sampling()([z_mean, z_log_var])
+    z = Sampling(dtype="float32")([z_mean, z_log_var])
     encoder = keras.Model(encoder_inputs, [z_mean, z_log_var, z], name="encoder")
     encoder.summary()
 
@@ -211,30 +152,97 @@ def model_builder(hp):
     if second_conv:
         x = layers.Conv1DTranspose(second_conv, kernel_size, activation="relu", padding="same")(x)
 
-    decoder_outputs = layers.Conv1DTranspose(16, kernel_size, activation="sigmoid", padding="same")(x)
+    # The sigmoid outputs are kept in float32 under a mixed precision policy
+    decoder_outputs = layers.Conv1DTranspose(16, kernel_size, activation="sigmoid", padding="same", dtype="float32")(x)
     decoder = keras.Model(latent_inputs, decoder_outputs, name="decoder")
     decoder.summary()
 
 
-    # Defines the model, compiles, and returns it
+    # Defines the model, compiles, and returns it. The model is built, so that
+    # Hyperband can save its weights and load them into a promoted trial.
     vae = VAE(encoder, decoder, beta)
-    vae.compile(loss = None, optimizer=keras.optimizers.Adam(learning_rate = learning_rate))
+    vae(encoder_inputs)
+    vae.compile(loss = None,
+                optimizer=keras.optimizers.Adam(learning_rate = learning_rate),
+                jit_compile = training_config.jit_compile)
     return vae
 
-# Initializes hyperband tuner
-tuner = kt.Hyperband(model_builder,
-                     objective='val_loss',
-                     max_epochs=20,
-                     factor=3,
-                     seed=42,
-                     directory='hypersearch',
-                     project_name='vae')
-
-# Print search space summary
-print(tuner.search_space_summary())
-
-# Starts hyperparameter search
-tuner.search(dataset_train, epochs=20, batch_size = 64, validation_data = (dataset_train, dataset_train))
+def build_tuner():
+    """Initializes the hyperband tuner
 
-# Prints hyperparameter search results
-print(tuner.results_summary())
+    When the KERASTUNER_TUNER_ID, KERASTUNER_ORACLE_IP and KERASTUNER_ORACLE_PORT
+    environment variables are set (see parallel_search.py), the tuner runs as
+    the chief or as one of the workers of a distributed search.
+    """
+    return kt.Hyperband(model_builder,
+                        objective='val_loss',
+                        max_epochs=20,
+                        factor=3,
+                        seed=42,
+                        directory='hypersearch',
+                        project_name='vae',
+                        # Diverged trials fail (see search_callbacks), and may come in a row
+                        max_consecutive_failed_trials=10)
+
+
+def search_callbacks(patience=3, max_kl_loss=1e4):
+    """Callbacks ending hopeless trials early
+
+    A trial stops when val_reconstruction_loss has not improved for patience
+    epochs, and fails when its loss is NaN or its KL loss explodes. Trials
+    promoted by Hyperband to a larger epoch budget start from the best weights
+    of their previous run, and continue from its last epoch.
+    """
+    return [
+        keras.callbacks.EarlyStopping(monitor="val_reconstruction_loss", mode="min", patience=patience),
+        DivergenceGuard(max_kl_loss=max_kl_loss, error=kt.errors.FailedTrialError),
+    ]
+
+
+def main():
+    global training_config
+
+    parser = argparse.ArgumentParser(description="Hyperparameter search of the VAE")
+    parser.add_argument("--validation-rate", type=float, default=0.25,
+                        help="fraction of the test set used for validation in each trial")
+    parser.add_argument("--patience", type=int, default=3,
+                        help="epochs without improvement of val_reconstruction_loss before a trial stops")
+    parser.add_argument("--max-kl-loss", type=float, default=1e4,
+                        help="KL loss above which a trial counts as diverged")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    training_config = from_args(args)
+    print("dtype policy:", training_config.apply())
+
+    # Loads dataset
+    dataset_train = WindowDataset.load("dataset_train")
+    dataset_test = WindowDataset.load("dataset_test")
+
+    # Builds the input pipelines once; all trials share them. Validation runs on a
+    # fixed subsample of the held-out test set, whose batches are cached after the first epoch.
+    train_data = windows_dataset(dataset_train, batch_size = 64)
+    validation_data = windows_dataset(
+        dataset_test.subsample(args.validation_rate, seed = 42),
+        batch_size = 64,
+        shuffle = False,
+        cache = True
+    )
+
+    tuner = build_tuner()
+
+    # Print search space summary
+    print(tuner.search_space_summary())
+
+    # Starts hyperparameter search
+    tuner.search(train_data,
+                 epochs=20,
+                 validation_data = validation_data,
+                 callbacks = search_callbacks(args.patience, args.max_kl_loss))
+
+    # Prints hyperparameter search results
+    print(tuner.results_summary())
+
+
+if __name__ == "__main__":
+    main()